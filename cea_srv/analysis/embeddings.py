@@ -0,0 +1,173 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Error signatures are a single traceback line; capping the token count
+# (MiniLM defaults to 256) cuts padding and attention cost. Analysis and
+# suggestion lookups must use the same cap so their embeddings match.
+MAX_SEQ_LENGTH = 64
+
+# ErrorCluster.embedding stores a raw, L2-normalized (EMBEDDING_DIM,) EMBEDDING_DTYPE vector
+EMBEDDING_DIM = 384
+EMBEDDING_DTYPE = np.float16
+
+# Directory holding an int8-quantized ONNX export of MODEL_NAME plus its
+# tokenizer files. When set (and onnxruntime is installed) CPU encoding goes
+# through ONNX Runtime instead of PyTorch.
+ONNX_MODEL_DIR = os.environ.get('CEA_ONNX_MODEL_DIR')
+ONNX_MODEL_FILE = os.environ.get('CEA_ONNX_MODEL_FILE', 'model-int8.onnx')
+
+# Window in which concurrent /suggest encodes are coalesced into one batch.
+# Off (0, encode inline) by default: every batched miss waits up to the window
+# plus a thread hop, which only pays off under sustained concurrent misses
+ENCODE_BATCH_MS = float(os.environ.get('CEA_ENCODE_BATCH_MS', '0'))
+ENCODE_BATCH_MAX = 32  # matches SentenceTransformer.encode's default batch_size
+
+log = logging.getLogger(__name__)
+
+
+class OnnxSentenceEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime
+
+    One-time export and quantization:
+        optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 mini/
+        python -c "from onnxruntime.quantization import quantize_dynamic, QuantType; \\
+                   quantize_dynamic('mini/model.onnx', 'mini/model-int8.onnx', weight_type=QuantType.QInt8)"
+    """
+
+    def __init__(self, model_dir, model_file=ONNX_MODEL_FILE):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=['CPUExecutionProvider']
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = MAX_SEQ_LENGTH
+
+    def _encode_batch(self, texts):
+        tokens = self._tokenizer(
+            texts,
+            padding='longest',
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors='np',
+        )
+        feeds = {name: tokens[name].astype(np.int64) for name in self._input_names if name in tokens}
+        token_embeddings = self._session.run(None, feeds)[0]
+
+        # Mean pooling over non-padding tokens
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        """Encode one string or a list of strings; mirrors SentenceTransformer.encode"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        if not sentences:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Length-sorted mini-batches so 'longest' padding stays short
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        batches = []
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            batches.append((idx, self._encode_batch([sentences[i] for i in idx])))
+
+        embeddings = np.empty((len(sentences), batches[0][1].shape[1]), dtype=np.float32)
+        for idx, emb in batches:
+            embeddings[idx] = emb
+
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+        return embeddings[0] if single else embeddings
+
+
+class EncodeBatcher:
+    """
+    Coalesces single-text encodes from concurrent request threads into one
+    model.encode call. A background thread takes the first queued text, waits
+    up to max_wait_ms for more, then encodes the batch length-sorted.
+    """
+
+    def __init__(self, model, max_wait_ms=ENCODE_BATCH_MS, max_batch=ENCODE_BATCH_MAX):
+        self._model = model
+        self._max_wait = max_wait_ms / 1000.0
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name='cea-encode-batcher', daemon=True).start()
+
+    def encode(self, text, timeout=30):
+        """Unit-norm embedding for one text; blocks until its batch has been encoded"""
+        future = Future()
+        self._queue.put((text, future))
+        return future.result(timeout=timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Length-sorted so padding within the batch stays short
+            batch.sort(key=lambda item: len(item[0]))
+            try:
+                embeddings = self._model.encode(
+                    [text for text, _ in batch], normalize_embeddings=True, convert_to_numpy=True
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+
+def load_onnx_encoder():
+    """Return an OnnxSentenceEncoder if one is configured and loadable, else None"""
+    if not ONNX_MODEL_DIR:
+        return None
+    try:
+        return OnnxSentenceEncoder(ONNX_MODEL_DIR)
+    except Exception:
+        log.exception("Error loading ONNX encoder, falling back to SentenceTransformer")
+        return None
+
+
+def embedding_to_bytes(embedding):
+    """Serialize an embedding vector for ErrorCluster.embedding"""
+    return np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def embedding_from_bytes(blob):
+    """Read back an ErrorCluster.embedding blob (zero-copy view)"""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def embeddings_from_bytes(blobs):
+    """Decode many ErrorCluster.embedding blobs into one (N, EMBEDDING_DIM) array in a single pass"""
+    return np.frombuffer(b''.join(blobs), dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
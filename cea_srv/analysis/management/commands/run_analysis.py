@@ -1,13 +1,136 @@
 from django.core.management.base import BaseCommand
 from telemetry.models import Beacon, EnvSnapshot
 from analysis.models import ErrorCluster, ConfigPattern, ErrorAnalysis
+from analysis.embeddings import MAX_SEQ_LENGTH, MODEL_NAME, embedding_to_bytes, load_onnx_encoder
+from analysis.patterns import init_worker, significant_patterns, significant_patterns_in_worker
+from analysis.services import invalidate_snapshot
+from django.db import transaction
 from django.db.models import Count, Q, F
-import json, math, hashlib, time, pickle
+import json, math, hashlib, os, time
 from sentence_transformers import SentenceTransformer
-import sklearn.cluster
+import torch
 import numpy as np
-from collections import defaultdict
-import re
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+# EnvSnapshot columns used directly as config keys
+_SCALAR_CONFIG_FIELDS = ('python_ver', 'machine_arch', 'os_info')
+
+# Environment variable names that are never analysed
+_SENSITIVE_ENV_VARS = frozenset(['password', 'secret', 'key', 'token', 'auth'])
+
+# Below this many clusters, process start-up costs more than the scoring itself
+_PARALLEL_MIN_CLUSTERS = 64
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Version operators in the order they are tried: the first one present in a
+# spec splits it, wherever it occurs ("a>1,==2" splits on "==")
+_PKG_SPEC_OPS = ('==', '>=', '<=', '>', '<')
+
+_MODEL = None  # Module-level singleton, reused across command invocations
+_DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+_BATCH_SIZE = 256 if _DEVICE == 'cuda' else 32
+
+
+def _get_model():
+    """Load the sentence encoder once per process (fp16 on GPU, ONNX int8 on CPU if configured)"""
+    global _MODEL
+    if _MODEL is None:
+        # CPU-only hosts prefer the int8 ONNX export when one is configured
+        model = load_onnx_encoder() if _DEVICE == 'cpu' else None
+        if model is None:
+            model = SentenceTransformer(MODEL_NAME, device=_DEVICE)
+            if _DEVICE == 'cuda':
+                model = model.half()
+        model.max_seq_length = MAX_SEQ_LENGTH
+        _MODEL = model
+    return _MODEL
+
+
+def _encode_sorted(model, texts, batch_size=_BATCH_SIZE):
+    """
+    Encode texts in length-sorted batches to minimise padding, then restore
+    the original order. Returns unit-normalized float32 embeddings.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    with torch.inference_mode():
+        emb_sorted = model.encode(
+            [texts[i] for i in order],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            normalize_embeddings=True,
+        )
+    # fp16 models hand back float16 rows
+    emb_sorted = emb_sorted.astype(np.float32, copy=False)
+    embeddings = np.empty_like(emb_sorted)
+    embeddings[order] = emb_sorted
+    return embeddings
+
+
+def _cluster_embeddings(embeddings, eps=0.3, block_size=2048, counts=None):
+    """
+    Cosine DBSCAN with min_samples=2 on unit-normalized embeddings.
+
+    With min_samples=2 every point that has at least one neighbour within eps
+    is a core point, so the clusters are exactly the connected components of
+    the eps-neighbourhood graph and isolated points are noise (-1). The graph
+    is built from blocked matrix products over the upper triangle, which
+    avoids sklearn's per-point neighbour queries.
+
+    counts: how many points each row stands for, when embeddings are already
+    deduplicated; a row standing for two or more points is its own neighbour
+    and so never noise.
+
+    Memory stays bounded: each block's similarities are block_size x N, and
+    the edge list is collapsed to a spanning forest (at most N - 1 edges)
+    whenever it outgrows a few edges per point.
+    """
+    n = len(embeddings)
+    min_similarity = 1.0 - eps
+    max_edges = 4 * n
+    has_neighbour = np.zeros(n, dtype=bool) if counts is None else np.asarray(counts) >= 2
+    rows, cols = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+    n_edges = 0
+    for start in range(0, n, block_size):
+        block = embeddings[start:start + block_size]
+        sims = block @ embeddings[start:].T
+        r, c = np.nonzero(sims >= min_similarity)
+        r += start
+        c += start
+        keep = r < c  # drop self-edges and the mirrored lower triangle
+        r, c = r[keep], c[keep]
+        has_neighbour[r] = True
+        has_neighbour[c] = True
+        rows.append(r)
+        cols.append(c)
+        n_edges += len(r)
+        if n_edges > max_edges:
+            forest_rows, forest_cols = _spanning_forest(np.concatenate(rows), np.concatenate(cols), n)
+            rows, cols = [forest_rows], [forest_cols]
+            n_edges = len(forest_rows)
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    labels[~has_neighbour] = -1
+    return labels
+
+
+def _spanning_forest(rows, cols, n):
+    """Edges joining every node to the first node of its component: same components, < n edges"""
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    _, first = np.unique(labels, return_index=True)
+    roots = first[labels]
+    nodes = np.flatnonzero(roots != np.arange(n))
+    return nodes, roots[nodes]
+
 
 class Command(BaseCommand):
     help = "Nightly error clustering & configuration pattern analysis"
@@ -28,37 +151,15 @@ class Command(BaseCommand):
             # Parse list format like ["build==1.2.2.post1", "certifi==2025.6.15", ...]
             parsed_packages = {}
             for pkg_spec in packages:
-                if isinstance(pkg_spec, str) and '==' in pkg_spec:
-                    # Handle "package==version" format
-                    parts = pkg_spec.split('==', 1)
-                    if len(parts) == 2:
-                        pkg_name, pkg_version = parts
-                        parsed_packages[pkg_name] = pkg_version
-                elif isinstance(pkg_spec, str) and '>=' in pkg_spec:
-                    # Handle "package>=version" format
-                    parts = pkg_spec.split('>=', 1)
-                    if len(parts) == 2:
-                        pkg_name, pkg_version = parts
-                        parsed_packages[pkg_name] = f">={pkg_version}"
-                elif isinstance(pkg_spec, str) and '<=' in pkg_spec:
-                    # Handle "package<=version" format
-                    parts = pkg_spec.split('<=', 1)
-                    if len(parts) == 2:
-                        pkg_name, pkg_version = parts
-                        parsed_packages[pkg_name] = f"<={pkg_version}"
-                elif isinstance(pkg_spec, str) and '>' in pkg_spec:
-                    # Handle "package>version" format
-                    parts = pkg_spec.split('>', 1)
-                    if len(parts) == 2:
-                        pkg_name, pkg_version = parts
-                        parsed_packages[pkg_name] = f">{pkg_version}"
-                elif isinstance(pkg_spec, str) and '<' in pkg_spec:
-                    # Handle "package<version" format
-                    parts = pkg_spec.split('<', 1)
-                    if len(parts) == 2:
-                        pkg_name, pkg_version = parts
-                        parsed_packages[pkg_name] = f"<{pkg_version}"
-                elif isinstance(pkg_spec, str):
+                if not isinstance(pkg_spec, str):
+                    continue
+                # Pinned "name==version" is the common case: one partition and done
+                for op in _PKG_SPEC_OPS:
+                    pkg_name, sep, pkg_version = pkg_spec.partition(op)
+                    if sep:
+                        parsed_packages[pkg_name] = pkg_version if op == '==' else f"{op}{pkg_version}"
+                        break
+                else:
                     # Just package name without version
                     parsed_packages[pkg_spec] = "unknown"
             
@@ -69,16 +170,10 @@ class Command(BaseCommand):
     def handle(self, *args, **opts):
         start_time = time.time()
         self.stdout.write("Starting error analysis...")
+        self._env_feature_cache = {}  # env.pk -> [(config_key, value), ...]
         
-        # Get all error beacons with their environment data
-        error_beacons = Beacon.objects.filter(kind='error').select_related()
-        
-        if not error_beacons.exists():
-            self.stdout.write("No error data to analyze")
-            return
-            
-        total_beacons = error_beacons.count()
-        self.stdout.write(f"Found {total_beacons} total error beacons")
+        # Stream error beacons, loading only the columns the analysis reads
+        error_beacons = Beacon.objects.filter(kind='error').only('error_sig', 'env_hash', 'ts')
         
         # Extract error signatures and get environment data
         error_texts = []
@@ -87,8 +182,13 @@ class Command(BaseCommand):
         # Deduplicate beacons: same error_sig + env_hash = same error occurrence
         seen_errors = set()
         duplicates_filtered = 0
+        total_beacons = 0
+        candidates = []
+        hashes = set()
         
-        for beacon in error_beacons:
+        for beacon in error_beacons.iterator(chunk_size=2000):
+            total_beacons += 1
+            
             # Create unique key for this error + environment combination
             error_key = f"{beacon.error_sig or ''}:{beacon.env_hash}"
             
@@ -99,22 +199,40 @@ class Command(BaseCommand):
             seen_errors.add(error_key)
             
             # Use error_sig directly since it's already the last line of the traceback
-            text = beacon.error_sig or "unknown"
+            text = (beacon.error_sig or "unknown").strip()
             
-            if text.strip():
-                error_texts.append(text.strip())
-                
-                # Get environment data for this beacon
-                try:
-                    env = EnvSnapshot.objects.get(env_hash=beacon.env_hash)
-                    beacon_env_data.append({
-                        'beacon': beacon,
-                        'text': text.strip(),
-                        'env': env
-                    })
-                except EnvSnapshot.DoesNotExist:
-                    # Skip if no environment data
-                    continue
+            if text:
+                candidates.append((beacon, text))
+                hashes.add(beacon.env_hash)
+        
+        if total_beacons == 0:
+            self.stdout.write("No error data to analyze")
+            return
+        
+        self.stdout.write(f"Found {total_beacons} total error beacons")
+        
+        # Fetch all referenced environments in one query instead of one per beacon
+        env_map = {
+            env.env_hash: env
+            for env in EnvSnapshot.objects.filter(env_hash__in=hashes).only(
+                'env_hash', 'python_ver', 'machine_arch', 'os_info', 'packages', 'env_vars'
+            )
+        }
+        
+        for beacon, text in candidates:
+            # Get environment data for this beacon
+            env = env_map.get(beacon.env_hash)
+            if env is None:
+                # Skip if no environment data
+                continue
+            
+            # Keep error_texts aligned with beacon_env_data (cluster labels index both)
+            error_texts.append(text)
+            beacon_env_data.append({
+                'beacon': beacon,
+                'text': text,
+                'env': env
+            })
         
         if not beacon_env_data:
             self.stdout.write("No error data with environment information")
@@ -123,86 +241,104 @@ class Command(BaseCommand):
         self.stdout.write(f"Filtered out {duplicates_filtered} duplicate beacons")
         self.stdout.write(f"Processing {len(beacon_env_data)} unique errors")
         
-        # Clear old analysis data
-        ErrorCluster.objects.all().delete()
-        ConfigPattern.objects.all().delete()
-            
-        # Automatic clustering using DBSCAN
+        # Automatic clustering of error embeddings
         try:
-            model = SentenceTransformer('all-MiniLM-L6-v2')
-            embeddings = model.encode(error_texts)
-            
-            # DBSCAN clustering
-            clustering = sklearn.cluster.DBSCAN(
-                eps=0.3,
-                min_samples=2,
-                metric='cosine'
+            model = _get_model()
+            # Only embed each distinct error text once, then fan out
+            uniq_texts, inverse, counts = np.unique(
+                np.array(error_texts, dtype=object), return_inverse=True, return_counts=True
             )
-            cluster_labels = clustering.fit_predict(embeddings)
+            embeddings = _encode_sorted(model, list(uniq_texts))
+            
+            # DBSCAN-equivalent clustering (eps=0.3, min_samples=2, cosine) over
+            # the distinct texts, then labels fanned back out to every error
+            cluster_labels = _cluster_embeddings(embeddings, eps=0.3, counts=counts)[inverse]
             
-            # Process clusters and store embeddings
-            clusters_created = 0
-            patterns_created = 0
+            cluster_objs = []
+            cluster_members = []
             
-            # Calculate global configuration statistics
-            global_config_stats = self._calculate_global_config_stats()
+            # Group member indices by label with one stable sort, so each group
+            # keeps beacon order and per-cluster timestamps reduce in one pass
+            order = np.argsort(cluster_labels, kind='stable')
+            labels, starts, sizes = np.unique(cluster_labels[order], return_index=True, return_counts=True)
+            ts_sorted = np.array(
+                [(beacon_env_data[i]['beacon'].ts - _EPOCH) // _ONE_MICROSECOND for i in order],
+                dtype=np.int64,
+            )
+            first_us = np.minimum.reduceat(ts_sorted, starts)
+            last_us = np.maximum.reduceat(ts_sorted, starts)
             
-            for cluster_id in set(cluster_labels):
+            for g, cluster_id in enumerate(labels):
                 if cluster_id == -1:  # Skip noise points
                     continue
-                    
-                # Get all beacons in this cluster
-                cluster_data = [
-                    beacon_env_data[i] 
-                    for i, label in enumerate(cluster_labels) 
-                    if label == cluster_id
-                ]
                 
-                if len(cluster_data) < 2:
+                if sizes[g] < 2:
                     continue
+                    
+                # Get all beacons in this cluster
+                members = order[starts[g]:starts[g] + sizes[g]]
+                cluster_data = [beacon_env_data[i] for i in members]
                 
                 # Create cluster hash and store embedding
                 representative_sig = cluster_data[0]['beacon'].error_sig or "Unknown Error"
-                cluster_hash = hashlib.sha256(representative_sig.encode()).hexdigest()[:32]
+                cluster_hash = hashlib.blake2b(representative_sig.encode(), digest_size=16).hexdigest()
                 
                 # Store the embedding for this cluster
-                cluster_embedding = embeddings[error_texts.index(cluster_data[0]['text'])]
-                embedding_bytes = pickle.dumps(cluster_embedding)
+                # (first member of the group, so no text lookup is needed)
+                cluster_embedding = embeddings[inverse[members[0]]]
+                embedding_bytes = embedding_to_bytes(cluster_embedding)
                 
                 # Calculate cluster statistics
                 error_count = len(cluster_data)
-                first_seen = min(data['beacon'].ts for data in cluster_data)
-                last_seen = max(data['beacon'].ts for data in cluster_data)
+                first_seen = _EPOCH + timedelta(microseconds=int(first_us[g]))
+                last_seen = _EPOCH + timedelta(microseconds=int(last_us[g]))
                 
-                # Create ErrorCluster
-                cluster_obj = ErrorCluster.objects.create(
+                cluster_objs.append(ErrorCluster(
                     cluster_hash=cluster_hash,
                     error_signature=representative_sig[:500],
                     error_count=error_count,
                     first_seen=first_seen,
                     last_seen=last_seen,
                     embedding=embedding_bytes
-                )
-                clusters_created += 1
+                ))
+                cluster_members.append(cluster_data)
+            
+            # Analyze configuration patterns for every cluster; the cluster FK
+            # is resolved when the patterns are inserted after their clusters
+            all_patterns = self._analyze_config_patterns(cluster_objs, cluster_members)
+            clusters_created = len(cluster_objs)
+            patterns_created = len(all_patterns)
+            
+            # Swap the old analysis for the new one in a single transaction
+            with transaction.atomic():
+                # Patterns first so the cluster delete has nothing left to cascade
+                ConfigPattern.objects.all().delete()
+                ErrorCluster.objects.all().delete()
                 
-                # Analyze configuration patterns for this cluster
-                cluster_patterns = self._analyze_cluster_config_patterns(
-                    cluster_data, global_config_stats, cluster_obj
+                ErrorCluster.objects.bulk_create(cluster_objs)
+                if any(obj.pk is None for obj in cluster_objs):
+                    # Backend can't return ids from bulk inserts, look them up by hash
+                    ids = dict(ErrorCluster.objects.filter(
+                        cluster_hash__in=[obj.cluster_hash for obj in cluster_objs]
+                    ).values_list('cluster_hash', 'id'))
+                    for obj in cluster_objs:
+                        obj.pk = ids[obj.cluster_hash]
+                ConfigPattern.objects.bulk_create(all_patterns, batch_size=500, ignore_conflicts=True)
+                
+                # Record analysis results
+                analysis_duration = time.time() - start_time
+                ErrorAnalysis.objects.create(
+                    total_errors_analyzed=len(beacon_env_data),
+                    clusters_found=clusters_created,
+                    patterns_found=patterns_created,
+                    analysis_duration=analysis_duration
                 )
-                patterns_created += len(cluster_patterns)
+            # Once for the whole swap; the bulk deletes above send no signals
+            invalidate_snapshot()
                     
         except Exception as e:
             self.stdout.write(f"Error during analysis: {e}")
             return
-            
-        # Record analysis results
-        analysis_duration = time.time() - start_time
-        ErrorAnalysis.objects.create(
-            total_errors_analyzed=len(beacon_env_data),
-            clusters_found=clusters_created,
-            patterns_found=patterns_created,
-            analysis_duration=analysis_duration
-        )
         
         self.stdout.write(f"Analysis complete!")
         self.stdout.write(f"  - Analyzed {len(beacon_env_data)} unique errors (deduplicated)")
@@ -210,116 +346,99 @@ class Command(BaseCommand):
         self.stdout.write(f"  - Found {patterns_created} significant config patterns")
         self.stdout.write(f"  - Duration: {analysis_duration:.2f} seconds")
     
-    def _calculate_global_config_stats(self):
-        """Calculate global configuration statistics across all environments"""
-        all_envs = EnvSnapshot.objects.all()
-        total_envs = all_envs.count()
+    def _config_items(self, env):
+        """Yield the (config_key, value) pairs describing an environment"""
+        # Python version, machine architecture, OS info
+        for field in _SCALAR_CONFIG_FIELDS:
+            yield (field, getattr(env, field))
+        yield from self._json_config_items(env)
+    
+    def _json_config_items(self, env):
+        """Yield the (config_key, value) pairs taken from the packages / env_vars JSON"""
+        # Package versions - parse both dict and list formats
+        parsed_packages = self._parse_packages(env.packages)
+        for pkg_name, pkg_version in parsed_packages.items():
+            yield (f'packages.{pkg_name}', str(pkg_version))
+        
+        # Environment variables - parse JSON field
+        env_vars = env.env_vars
+        if env_vars and isinstance(env_vars, dict):
+            for env_var_name, env_var_value in env_vars.items():
+                # Skip very long values or sensitive data
+                if len(str(env_var_value)) > 200:
+                    continue
+                # Skip common sensitive environment variables
+                if env_var_name.lower() in _SENSITIVE_ENV_VARS:
+                    continue
+                yield (f'env_vars.{env_var_name}', str(env_var_value))
+    
+    def _env_features(self, env):
+        """(config_key, value) pairs for an environment, built once per run"""
+        features = self._env_feature_cache.get(env.pk)
+        if features is None:
+            features = self._env_feature_cache[env.pk] = list(self._config_items(env))
+        return features
+    
+    def _calculate_global_config_stats(self, needed_pairs):
+        """
+        Calculate global rates across all environments, for the given pairs only
+        Returns: dict of {(config_key, value): global_rate}
+        """
+        total_envs = EnvSnapshot.objects.count()
         
         if total_envs == 0:
             return {}
         
-        config_stats = defaultdict(lambda: defaultdict(int))
+        config_counts = Counter()
         
-        for env in all_envs:
-            # Python version
-            config_stats['python_ver'][env.python_ver] += 1
-            
-            # Machine architecture
-            config_stats['machine_arch'][env.machine_arch] += 1
-            
-            # OS info
-            config_stats['os_info'][env.os_info] += 1
-            
-            # Package versions - parse both dict and list formats
-            parsed_packages = self._parse_packages(env.packages)
-            for pkg_name, pkg_version in parsed_packages.items():
-                config_stats[f'packages.{pkg_name}'][str(pkg_version)] += 1
-            
-            # Environment variables - parse JSON field
-            env_vars = env.env_vars
-            if env_vars and isinstance(env_vars, dict):
-                for env_var_name, env_var_value in env_vars.items():
-                    # Skip very long values or sensitive data
-                    if len(str(env_var_value)) > 200:
-                        continue
-                    # Skip common sensitive environment variables
-                    if env_var_name.lower() in ['password', 'secret', 'key', 'token', 'auth']:
-                        continue
-                    config_stats[f'env_vars.{env_var_name}'][str(env_var_value)] += 1
+        # Scalar columns are grouped in SQL, without loading any rows
+        for field in _SCALAR_CONFIG_FIELDS:
+            for value, count in EnvSnapshot.objects.values_list(field).annotate(n=Count('id')).order_by():
+                config_counts[(field, value)] = count
         
-        # Convert to rates
-        global_rates = {}
-        for config_key, value_counts in config_stats.items():
-            global_rates[config_key] = {}
-            for value, count in value_counts.items():
-                global_rates[config_key][value] = count / total_envs
+        # JSON columns have to be parsed in Python; only count pairs some cluster uses
+        needed_json_pairs = {pair for pair in needed_pairs if pair[0] not in _SCALAR_CONFIG_FIELDS}
+        if needed_json_pairs:
+            for env in EnvSnapshot.objects.only('packages', 'env_vars').iterator(chunk_size=2000):
+                features = self._env_feature_cache.get(env.pk) or self._json_config_items(env)
+                config_counts.update(pair for pair in features if pair in needed_json_pairs)
         
-        return global_rates
+        # Convert to rates
+        return {pair: count / total_envs for pair, count in config_counts.items()}
     
-    def _analyze_cluster_config_patterns(self, cluster_data, global_stats, cluster_obj):
-        """Find configuration patterns that are statistically significant in this cluster"""
-        patterns = []
-        cluster_size = len(cluster_data)
+    def _analyze_config_patterns(self, cluster_objs, cluster_members):
+        """
+        Score configuration patterns for every cluster, in worker processes when there are many
+        Returns: list of unsaved ConfigPattern instances
+        """
+        feature_groups = [
+            [self._env_features(data['env']) for data in cluster_data]
+            for cluster_data in cluster_members
+        ]
         
-        # Collect configuration data for this cluster
-        cluster_configs = defaultdict(lambda: defaultdict(int))
+        # Global rates are only ever looked up for pairs seen in some cluster
+        needed_pairs = {pair for group in feature_groups for features in group for pair in features}
+        global_stats = self._calculate_global_config_stats(needed_pairs)
         
-        for data in cluster_data:
-            env = data['env']
-            
-            # Python version
-            cluster_configs['python_ver'][env.python_ver] += 1
-            
-            # Machine architecture
-            cluster_configs['machine_arch'][env.machine_arch] += 1
-            
-            # OS info
-            cluster_configs['os_info'][env.os_info] += 1
-            
-            # Package versions - parse both dict and list formats
-            parsed_packages = self._parse_packages(env.packages)
-            for pkg_name, pkg_version in parsed_packages.items():
-                cluster_configs[f'packages.{pkg_name}'][str(pkg_version)] += 1
-            
-            # Environment variables - parse JSON field
-            env_vars = env.env_vars
-            if env_vars and isinstance(env_vars, dict):
-                for env_var_name, env_var_value in env_vars.items():
-                    # Skip very long values or sensitive data
-                    if len(str(env_var_value)) > 200:
-                        continue
-                    # Skip common sensitive environment variables
-                    if env_var_name.lower() in ['password', 'secret', 'key', 'token', 'auth']:
-                        continue
-                    cluster_configs[f'env_vars.{env_var_name}'][str(env_var_value)] += 1
+        if len(feature_groups) >= _PARALLEL_MIN_CLUSTERS:
+            with ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                initializer=init_worker,
+                initargs=(global_stats,),
+            ) as pool:
+                scored = list(pool.map(significant_patterns_in_worker, feature_groups, chunksize=16))
+        else:
+            scored = [significant_patterns(group, global_stats) for group in feature_groups]
         
-        # Calculate significance scores
-        for config_key, value_counts in cluster_configs.items():
-            for value, count in value_counts.items():
-                occurrence_rate = count / cluster_size
-                
-                # Get global rate for this config value
-                # Default to 1% if not found globally - this ensures we can detect rare configurations
-                global_rate = global_stats.get(config_key, {}).get(value, 0.01)
-                
-                # Calculate significance (how much more common this is in the cluster vs globally)
-                # A high significance score means this config is much more common in error clusters
-                significance_score = occurrence_rate / global_rate
-                
-                # Only store patterns that are significantly more common in this cluster
-                if significance_score > 1.5 and occurrence_rate > 0.65:  # 50% more common and appears in 65%+ of cluster
-                    ConfigPattern.objects.create(
-                        cluster=cluster_obj,
-                        config_key=config_key,
-                        config_value=value,
-                        occurrence_rate=occurrence_rate,
-                        global_rate=global_rate,
-                        significance_score=significance_score
-                    )
-                    patterns.append({
-                        'config_key': config_key,
-                        'config_value': value,
-                        'significance': significance_score
-                    })
-        
-        return patterns
\ No newline at end of file
+        return [
+            ConfigPattern(
+                cluster=cluster_obj,
+                config_key=config_key,
+                config_value=value,
+                occurrence_rate=occurrence_rate,
+                global_rate=global_rate,
+                significance_score=significance_score
+            )
+            for cluster_obj, rows in zip(cluster_objs, scored)
+            for config_key, value, occurrence_rate, global_rate, significance_score in rows
+        ]
@@ -0,0 +1,29 @@
+import pickle
+
+import numpy as np
+from django.db import migrations
+
+RAW_EMBEDDING_BYTES = 384 * 2  # (384,) float16
+
+
+def pickled_to_raw_float16(apps, schema_editor):
+    """Rewrite legacy pickled ndarray embeddings as raw float16 bytes"""
+    ErrorCluster = apps.get_model("analysis", "ErrorCluster")
+    for cluster in ErrorCluster.objects.only("id", "embedding").iterator():
+        blob = bytes(cluster.embedding)
+        if len(blob) == RAW_EMBEDDING_BYTES:
+            continue
+        embedding = pickle.loads(blob)
+        cluster.embedding = np.ascontiguousarray(embedding, dtype=np.float16).tobytes()
+        cluster.save(update_fields=["embedding"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analysis", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(pickled_to_raw_float16, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+import numpy as np
+from django.db import migrations
+
+
+def normalize_embeddings(apps, schema_editor):
+    """Rescale stored cluster embeddings to unit L2 norm"""
+    ErrorCluster = apps.get_model("analysis", "ErrorCluster")
+    for cluster in ErrorCluster.objects.only("id", "embedding").iterator():
+        embedding = np.frombuffer(bytes(cluster.embedding), dtype=np.float16).astype(np.float32)
+        norm = np.linalg.norm(embedding)
+        if norm == 0 or abs(norm - 1.0) < 1e-3:
+            continue
+        cluster.embedding = (embedding / norm).astype(np.float16).tobytes()
+        cluster.save(update_fields=["embedding"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analysis", "0002_embedding_raw_float16"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_embeddings, migrations.RunPython.noop),
+    ]
@@ -8,7 +8,7 @@ class ErrorCluster(models.Model):
     error_count = models.IntegerField()
     first_seen = models.DateTimeField()
     last_seen = models.DateTimeField()
-    embedding = models.BinaryField()  # Pre-computed embedding for fast similarity search
+    embedding = models.BinaryField()  # Pre-computed unit-norm embedding, raw float16 bytes of shape (384,)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -0,0 +1,68 @@
+"""
+Configuration pattern scoring for error clusters.
+
+Kept free of Django imports so run_analysis can fan clusters out to worker
+processes without each worker setting up Django.
+"""
+from collections import Counter
+
+import numpy as np
+
+_GLOBAL_STATS = {}  # Per-worker copy, set once by init_worker
+
+
+def significant_patterns(feature_lists, global_stats):
+    """
+    Find configuration patterns that are statistically significant in one cluster
+    feature_lists: one list of (config_key, value) pairs per cluster member
+    Returns: list of (config_key, value, occurrence_rate, global_rate, significance_score)
+    """
+    patterns = []
+    cluster_size = len(feature_lists)
+
+    # Collect configuration data for this cluster
+    cluster_configs = Counter()
+    for features in feature_lists:
+        cluster_configs.update(features)
+
+    # Calculate significance scores for all pairs at once
+    pairs = list(cluster_configs)
+    counts = np.fromiter(cluster_configs.values(), dtype=np.float64, count=len(pairs))
+    occurrence_rates = counts / cluster_size
+
+    # Only configs that appear in 65%+ of the cluster can qualify, so the
+    # global rates are looked up for those alone
+    candidates = np.flatnonzero(occurrence_rates > 0.65)
+
+    # Get global rate for each candidate config value
+    # Default to 1% if not found globally - this ensures we can detect rare configurations
+    global_rates = np.fromiter(
+        (global_stats.get(pairs[i], 0.01) for i in candidates), dtype=np.float64, count=len(candidates)
+    )
+
+    # Calculate significance (how much more common this is in the cluster vs globally)
+    # A high significance score means this config is much more common in error clusters
+    significance_scores = occurrence_rates[candidates] / global_rates
+
+    # Only store patterns that are 50%+ more common in this cluster than globally
+    for j in np.flatnonzero(significance_scores > 1.5):
+        config_key, value = pairs[candidates[j]]
+        patterns.append((
+            config_key,
+            value,
+            float(occurrence_rates[candidates[j]]),
+            float(global_rates[j]),
+            float(significance_scores[j]),
+        ))
+
+    return patterns
+
+
+def init_worker(global_stats):
+    """ProcessPoolExecutor initializer: ship the global rates once per worker, not per task"""
+    global _GLOBAL_STATS
+    _GLOBAL_STATS = global_stats
+
+
+def significant_patterns_in_worker(feature_lists):
+    return significant_patterns(feature_lists, _GLOBAL_STATS)
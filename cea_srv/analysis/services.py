@@ -1,26 +1,241 @@
-import pickle
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from operator import attrgetter
 import numpy as np
+from django.db import connections
+from django.db.models import Count, Max
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from analysis.models import ErrorCluster, ConfigPattern
+from analysis.embeddings import ENCODE_BATCH_MS, MAX_SEQ_LENGTH, MODEL_NAME, EncodeBatcher, embeddings_from_bytes, load_onnx_encoder
 from sentence_transformers import SentenceTransformer
 
+log = logging.getLogger(__name__)
+
+# Process-local snapshot of the cluster table: every embedding stacked into
+# one contiguous matrix (a lookup is a single matrix-vector product) plus the
+# fields a suggestion reports, so the hot path never scans ErrorCluster.
+# Snapshots are immutable and swapped in whole, so readers need no lock.
+_ClusterSnapshot = namedtuple('_ClusterSnapshot', [
+    'version',      # cluster-table fingerprint the snapshot was built from
+    'matrix',       # (N, EMBEDDING_DIM) float32 unit-norm rows, or int8 when quantized
+    'scales',       # (N,) per-row dequantization scales, None when not quantized
+    'cluster_ids',  # matrix row -> ErrorCluster.id
+    'clusters',     # ErrorCluster.id -> {field: value} for _CLUSTER_INFO_FIELDS
+    'sig_index',    # stripped error_signature -> ErrorCluster.id, for exact repeats
+])
+_SNAPSHOT = None
+_SNAPSHOT_CHECKED_AT = 0.0
+_SNAPSHOT_LOCK = threading.RLock()  # serializes rebuilds and invalidation
+
+# Saves in this process and run_analysis invalidate the snapshot immediately;
+# everything else is caught by re-checking the (count, max id) fingerprint
+# this often. That fingerprint misses an in-place update made by another
+# process (signals only fire in their own), which goes unseen until a
+# cluster is added or removed.
+_SNAPSHOT_CHECK_SECONDS = 5.0
+
+# Fields a suggestion reports about a matched cluster; never the embedding blob
+_CLUSTER_INFO_FIELDS = ('error_signature', 'error_count', 'first_seen', 'last_seen')
+
+# Above this many clusters the matrix is kept as int8 (a quarter of the
+# memory per worker) and used only to screen; the few candidates near the
+# threshold are rescored exactly from their stored embeddings
+_QUANTIZE_MIN_CLUSTERS = 20000
+_SCREEN_MARGIN = 0.02       # int8 cosine error stays well under this
+_SCREEN_CHUNK_ROWS = 8192   # rows upcast to float32 per BLAS call without numba
+
+
+def _clusters_version():
+    """Cheap fingerprint of the cluster table; changes whenever run_analysis rebuilds it"""
+    agg = ErrorCluster.objects.aggregate(n=Count('id'), last=Max('id'))
+    return (agg['n'], agg['last'])
+
+
+def _build_snapshot(version):
+    rows = list(ErrorCluster.objects.values_list('id', 'embedding', *_CLUSTER_INFO_FIELDS))
+    # Fixed-size raw blobs: one join and one frombuffer for the whole table
+    matrix = embeddings_from_bytes([row[1] for row in rows]).astype(np.float32)
+    # Stored embeddings are unit-norm; renormalizing once here absorbs the
+    # float16 rounding so each lookup is a bare dot product
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+    matrix = np.ascontiguousarray(matrix / np.clip(norms, 1e-12, None)[:, None])
+    scales = None
+    if len(rows) >= _QUANTIZE_MIN_CLUSTERS:
+        matrix, scales = _quantize_int8(matrix)
+    return _ClusterSnapshot(
+        version=version,
+        matrix=matrix,
+        scales=scales,
+        cluster_ids=[row[0] for row in rows],
+        clusters={row[0]: dict(zip(_CLUSTER_INFO_FIELDS, row[2:])) for row in rows},
+        sig_index={row[2].strip(): row[0] for row in rows},
+    )
+
+
+def _get_snapshot():
+    """Return the current cluster snapshot, rebuilding it if the clusters changed"""
+    global _SNAPSHOT, _SNAPSHOT_CHECKED_AT
+    snapshot = _SNAPSHOT
+    if snapshot is not None and time.monotonic() - _SNAPSHOT_CHECKED_AT < _SNAPSHOT_CHECK_SECONDS:
+        return snapshot
+    with _SNAPSHOT_LOCK:
+        # Read the global once; the result is never None
+        snapshot = _SNAPSHOT
+        # Another thread may have refreshed it while we waited
+        if snapshot is not None and time.monotonic() - _SNAPSHOT_CHECKED_AT < _SNAPSHOT_CHECK_SECONDS:
+            return snapshot
+        version = _clusters_version()
+        if snapshot is None or snapshot.version != version:
+            snapshot = _SNAPSHOT = _build_snapshot(version)
+        _SNAPSHOT_CHECKED_AT = time.monotonic()
+        return snapshot
+
+
+def _screen_int8_numpy(matrix, scales, query):
+    """Approximate cosines from the int8 matrix, upcasting a chunk of rows per BLAS call"""
+    approx = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], _SCREEN_CHUNK_ROWS):
+        stop = start + _SCREEN_CHUNK_ROWS
+        approx[start:stop] = matrix[start:stop].astype(np.float32) @ query
+    return approx * scales
+
+
+try:
+    from numba import njit, prange
+except ImportError:
+    _screen_int8 = _screen_int8_numpy
+else:
+    @njit(cache=True, parallel=True, fastmath=True)
+    def _screen_int8(matrix, scales, query):
+        """Same as _screen_int8_numpy, reading the int8 rows directly across threads"""
+        approx = np.empty(matrix.shape[0], dtype=np.float32)
+        for i in prange(matrix.shape[0]):
+            total = np.float32(0.0)
+            for j in range(matrix.shape[1]):
+                total += np.float32(matrix[i, j]) * query[j]
+            approx[i] = total * scales[i]
+        return approx
+
+
+def _quantize_int8(matrix):
+    """Symmetric per-row int8 quantization: row ~= scale * int8_row"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+_BATCHER = None
+_SERVICE = None
+_SINGLETON_LOCK = threading.Lock()  # guards building _BATCHER and _SERVICE
+
+
+def _get_batcher():
+    global _BATCHER
+    with _SINGLETON_LOCK:
+        if _BATCHER is None:
+            _BATCHER = EncodeBatcher(ConfigSuggestionService._model)
+    return _BATCHER
+
+
+def _reset_after_fork():
+    """A forked worker inherits _BATCHER but not its thread; start a fresh one on first use"""
+    global _BATCHER
+    _BATCHER = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_cached(text):
+    """Unit-norm float32 embedding bytes for one error text; repeat errors skip the model"""
+    if ENCODE_BATCH_MS > 0:
+        embedding = _get_batcher().encode(text)
+    else:
+        embedding = ConfigSuggestionService._model.encode(
+            [text], normalize_embeddings=True, convert_to_numpy=True
+        )[0]
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def invalidate_snapshot():
+    """Rebuild the cluster snapshot on the next lookup"""
+    global _SNAPSHOT
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT = None
+
+
+# post_save only: a post_delete receiver would stop Django's fast delete and
+# make run_analysis load every cluster row just to send a signal per row
+@receiver(post_save, sender=ErrorCluster)
+def _invalidate_snapshot(sender, **kwargs):
+    """In-process cluster saves (admin, tests) rebuild the snapshot on the next lookup"""
+    invalidate_snapshot()
+
 class ConfigSuggestionService:
     _model = None  # Class-level singleton
+    __slots__ = ()  # Stateless instances; self._model reads the class attribute
     
     def __init__(self):
         # Load the model once for the entire class
         if ConfigSuggestionService._model is None:
             try:
-                ConfigSuggestionService._model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
-            except Exception as e:
-                print(f"Error loading SentenceTransformer model: {e}")
+                # Prefer the int8 ONNX Runtime encoder when one is configured
+                model = load_onnx_encoder()
+                if model is None:
+                    model = SentenceTransformer(MODEL_NAME, device='cpu')
+                    model.max_seq_length = MAX_SEQ_LENGTH
+                ConfigSuggestionService._model = model
+            except Exception:
+                log.exception("Error loading SentenceTransformer model")
                 # Set a flag to indicate model loading failed
                 ConfigSuggestionService._model = "ERROR"
-        self._model = ConfigSuggestionService._model
     
+    def warmup(self):
+        """
+        Pay the first-lookup costs up front: the cluster snapshot build, the
+        first encode (batcher thread, model kernels) and, for large cluster
+        sets, the numba JIT of the int8 screen. Never raises.
+        
+        Run it in the process that serves requests, not in a preloading
+        master: the encode starts torch's OpenMP/MKL thread pools, which are
+        not fork-safe. The database connections it opened are closed again.
+        """
+        try:
+            snapshot = _get_snapshot()
+            if self._model == "ERROR" or self._model is None:
+                return
+            # Through the encode path but around the LRU, which is left empty
+            embedding = np.frombuffer(_encode_cached.__wrapped__("__warmup__"), dtype=np.float32)
+            if snapshot.cluster_ids:
+                self._rank_clusters(snapshot, embedding, 1.0, 1)
+        except Exception:
+            log.exception("Suggestion service warmup failed")
+        finally:
+            # Reconnected lazily; forked workers must not share the socket
+            connections.close_all()
+
+    def _check_model(self):
+        if self._model == "ERROR" or self._model is None:
+            raise RuntimeError("SentenceTransformer model not available")
+
+    def clusters_version(self):
+        """Fingerprint of the cluster set suggestions are currently answered from"""
+        return _get_snapshot().version
+
     def find_config_suggestion(self, error_sig, error_trace=None, threshold=0.9, max_suggestions=3):
         """
         Find the most significant configuration patterns for a similar error
         Returns: dict with relevant configuration suggestions or None
+        Raises if the error text can't be encoded (model missing, encode failed)
         """
         if not error_sig and not error_trace:
             return None
@@ -30,49 +245,36 @@ class ConfigSuggestionService:
             
         if not error_text.strip():
             return None
-        
-        # Check if model loaded successfully
-        if self._model == "ERROR" or self._model is None:
-            print("SentenceTransformer model not available")
-            return None
             
-        # Get all existing clusters with their pre-computed embeddings
-        clusters = ErrorCluster.objects.prefetch_related('config_patterns').all()
+        # Get all existing clusters' pre-computed embeddings
+        snapshot = _get_snapshot()
         
-        if not clusters.exists():
-            return None
-            
-        # Encode the new error (only time we need the model)
-        try:
-            new_error_embedding = self._model.encode([error_text.strip()])[0]
-        except Exception as e:
-            print(f"Error encoding error text: {e}")
+        if not snapshot.cluster_ids:
             return None
         
-        # Find the most similar cluster using pre-computed embeddings
-        best_match = None
-        best_similarity = 0
-        
-        for cluster in clusters:
-            # Load pre-computed embedding
-            cluster_embedding = pickle.loads(cluster.embedding)
-            
-            # Calculate cosine similarity
-            similarity = np.dot(new_error_embedding, cluster_embedding) / (
-                np.linalg.norm(new_error_embedding) * np.linalg.norm(cluster_embedding)
-            )
+        # A literal repeat of a cluster's signature needs neither the model nor the scan
+        best_id = snapshot.sig_index.get(error_text.strip())
+        if best_id is not None:
+            best_similarity = 1.0
+        else:
+            # Encode the new error (only time we need the model). Failures
+            # raise rather than return None, so they aren't taken for a miss
+            self._check_model()
+            new_error_embedding = np.frombuffer(_encode_cached(error_text.strip()), dtype=np.float32)
             
-            if similarity > best_similarity and similarity >= threshold:
-                best_similarity = similarity
-                best_match = cluster
-        
-        if not best_match:
-            return None
+            # Find the most similar cluster using pre-computed embeddings
+            ranked = self._rank_clusters(snapshot, new_error_embedding, threshold, 1)
+            if not ranked or ranked[0][1] <= 0:
+                return None
+            best_id, best_similarity = ranked[0]
+        best_match = snapshot.clusters[best_id]
             
         # Get multiple significant configuration patterns for this cluster
-        significant_patterns = best_match.config_patterns.order_by('-significance_score')[:max_suggestions]
+        significant_patterns = list(
+            ConfigPattern.objects.filter(cluster_id=best_id).order_by('-significance_score')[:max_suggestions]
+        )
         
-        if not significant_patterns.exists():
+        if not significant_patterns:
             return None
             
         # Create suggestions for each significant pattern
@@ -91,15 +293,51 @@ class ConfigSuggestionService:
         
         return {
             'similarity': best_similarity,
-            'total_similar_errors': best_match.error_count,
+            'total_similar_errors': best_match['error_count'],
             'suggestions': suggestions,
             'cluster_info': {
-                'first_seen': best_match.first_seen,
-                'last_seen': best_match.last_seen,
-                'error_signature': best_match.error_signature
+                'first_seen': best_match['first_seen'],
+                'last_seen': best_match['last_seen'],
+                'error_signature': best_match['error_signature']
             }
         }
     
+    @classmethod
+    def _rank_clusters(cls, snapshot, embedding, threshold, k):
+        """
+        Return up to k (cluster_id, similarity) pairs at or above threshold, best first
+        The query embedding must already be unit-norm
+        """
+        query = np.asarray(embedding, dtype=np.float32)  # unit-norm from encode
+        matrix, scales, cluster_ids = snapshot.matrix, snapshot.scales, snapshot.cluster_ids
+        
+        if scales is None:
+            similarities = matrix @ query
+            top = cls._top_k(similarities, threshold, k)
+            return [(cluster_ids[i], float(similarities[i])) for i in top]
+        
+        # Quantized matrix: screen with approximate cosines, then rescore the
+        # survivors from their exact stored embeddings
+        approx = _screen_int8(matrix, scales, query)
+        
+        candidates = cls._top_k(approx, threshold - _SCREEN_MARGIN, max(4 * k, 32))
+        if not len(candidates):
+            return []
+        candidate_ids = [cluster_ids[i] for i in candidates]
+        rows = list(ErrorCluster.objects.filter(pk__in=candidate_ids).values_list('id', 'embedding'))
+        exact_rows = embeddings_from_bytes([blob for _, blob in rows]).astype(np.float32)
+        exact = (exact_rows @ query) / np.sqrt(np.einsum('ij,ij->i', exact_rows, exact_rows))
+        top = cls._top_k(exact, threshold, k)
+        return [(rows[i][0], float(exact[i])) for i in top]
+    
+    @staticmethod
+    def _top_k(similarities, threshold, k):
+        """Indices of the k highest similarities at or above threshold, best first"""
+        candidates = np.flatnonzero(similarities >= threshold)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-similarities[candidates], k - 1)[:k]]
+        return candidates[np.argsort(-similarities[candidates], kind='stable')]
+    
     def _format_config_suggestion(self, pattern, confidence_percentage):
         """Format the configuration pattern into a human-readable suggestion"""
         config_key = pattern.config_key
@@ -131,6 +369,7 @@ class ConfigSuggestionService:
         """
         Find configuration suggestions from multiple similar clusters
         Returns: dict with suggestions from multiple clusters or None
+        Raises if the error text can't be encoded (model missing, encode failed)
         """
         if not error_sig and not error_trace:
             return None
@@ -141,53 +380,40 @@ class ConfigSuggestionService:
         if not error_text.strip():
             return None
         
-        # Check if model loaded successfully
-        if self._model == "ERROR" or self._model is None:
-            print("SentenceTransformer model not available")
-            return None
-            
-        # Get all existing clusters with their pre-computed embeddings
-        clusters = ErrorCluster.objects.prefetch_related('config_patterns').all()
+        # Get all existing clusters' pre-computed embeddings
+        snapshot = _get_snapshot()
         
-        if not clusters.exists():
+        if not snapshot.cluster_ids:
             return None
             
-        # Encode the new error (only time we need the model)
-        try:
-            new_error_embedding = self._model.encode([error_text.strip()])[0]
-        except Exception as e:
-            print(f"Error encoding error text: {e}")
-            return None
+        # Encode the new error (only time we need the model). Failures
+        # raise rather than return None, so they aren't taken for a miss
+        self._check_model()
+        new_error_embedding = np.frombuffer(_encode_cached(error_text.strip()), dtype=np.float32)
         
         # Find multiple similar clusters using pre-computed embeddings
-        similar_clusters = []
-        
-        for cluster in clusters:
-            # Load pre-computed embedding
-            cluster_embedding = pickle.loads(cluster.embedding)
-            
-            # Calculate cosine similarity
-            similarity = np.dot(new_error_embedding, cluster_embedding) / (
-                np.linalg.norm(new_error_embedding) * np.linalg.norm(cluster_embedding)
-            )
-            
-            if similarity >= threshold:
-                similar_clusters.append((cluster, similarity))
-        
-        # Sort by similarity and take top clusters
-        similar_clusters.sort(key=lambda x: x[1], reverse=True)
-        similar_clusters = similar_clusters[:max_clusters]
+        similar_clusters = self._rank_clusters(snapshot, new_error_embedding, threshold, max_clusters)
         
         if not similar_clusters:
             return None
+        
+        top_ids = [cluster_id for cluster_id, _ in similar_clusters]
             
+        # One query for the patterns of every matched cluster, split per cluster
+        patterns = ConfigPattern.objects.filter(cluster_id__in=top_ids).order_by('cluster_id', '-significance_score')
+        patterns_by_cluster = {
+            cluster_id: list(group)[:max_suggestions_per_cluster]
+            for cluster_id, group in itertools.groupby(patterns, key=attrgetter('cluster_id'))
+        }
+        
         # Collect suggestions from all similar clusters
         all_suggestions = []
         cluster_info = []
         
-        for cluster, similarity in similar_clusters:
+        for cluster_id, similarity in similar_clusters:
             # Get significant patterns for this cluster
-            significant_patterns = cluster.config_patterns.order_by('-significance_score')[:max_suggestions_per_cluster]
+            significant_patterns = patterns_by_cluster.get(cluster_id, [])
+            cluster = snapshot.clusters[cluster_id]
             
             cluster_suggestions = []
             for pattern in significant_patterns:
@@ -206,10 +432,10 @@ class ConfigSuggestionService:
                 all_suggestions.extend(cluster_suggestions)
                 cluster_info.append({
                     'similarity': similarity,
-                    'error_count': cluster.error_count,
-                    'first_seen': cluster.first_seen,
-                    'last_seen': cluster.last_seen,
-                    'error_signature': cluster.error_signature
+                    'error_count': cluster['error_count'],
+                    'first_seen': cluster['first_seen'],
+                    'last_seen': cluster['last_seen'],
+                    'error_signature': cluster['error_signature']
                 })
         
         if not all_suggestions:
@@ -247,4 +473,15 @@ class ConfigSuggestionService:
                 }
                 for pattern in top_patterns
             ]
-        } 
\ No newline at end of file
+        } 
+
+
+def get_suggestion_service():
+    """The process-wide ConfigSuggestionService, built (and its model loaded) on first call"""
+    global _SERVICE
+    if _SERVICE is None:
+        with _SINGLETON_LOCK:
+            # Concurrent first callers wait for one model load instead of each doing one
+            if _SERVICE is None:
+                _SERVICE = ConfigSuggestionService()
+    return _SERVICE
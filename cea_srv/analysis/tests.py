@@ -1,13 +1,14 @@
 from django.test import TestCase
 from django.utils import timezone
 from analysis.models import ErrorCluster, ConfigPattern
-from analysis.services import ConfigSuggestionService
-import pickle
+from analysis.services import ConfigSuggestionService, _encode_cached
+from analysis.embeddings import embedding_to_bytes
 import numpy as np
 
 class ConfigSuggestionServiceTest(TestCase):
     def setUp(self):
         self.service = ConfigSuggestionService()
+        _encode_cached.cache_clear()  # Each test mocks its own embedding
         
         # Create test clusters with embeddings
         self.cluster1 = ErrorCluster.objects.create(
@@ -16,7 +17,7 @@ class ConfigSuggestionServiceTest(TestCase):
             error_count=5,
             first_seen=timezone.now(),
             last_seen=timezone.now(),
-            embedding=pickle.dumps(np.random.rand(384))  # Mock embedding
+            embedding=embedding_to_bytes(np.random.rand(384))  # Mock embedding
         )
         
         self.cluster2 = ErrorCluster.objects.create(
@@ -25,7 +26,7 @@ class ConfigSuggestionServiceTest(TestCase):
             error_count=3,
             first_seen=timezone.now(),
             last_seen=timezone.now(),
-            embedding=pickle.dumps(np.random.rand(384))  # Mock embedding
+            embedding=embedding_to_bytes(np.random.rand(384))  # Mock embedding
         )
         
         # Create config patterns for cluster1
@@ -61,10 +62,10 @@ class ConfigSuggestionServiceTest(TestCase):
         """Test that find_config_suggestion returns multiple patterns when available"""
         # Mock the model to return a predictable embedding
         mock_embedding = np.random.rand(384)
-        self.service._model.encode = lambda x: [mock_embedding]
+        self.service._model.encode = lambda texts, **kwargs: [mock_embedding]
         
         # Set the cluster embedding to be similar to our mock
-        self.cluster1.embedding = pickle.dumps(mock_embedding)
+        self.cluster1.embedding = embedding_to_bytes(mock_embedding)
         self.cluster1.save()
         
         result = self.service.find_config_suggestion(
@@ -85,12 +86,12 @@ class ConfigSuggestionServiceTest(TestCase):
         """Test that find_multiple_cluster_suggestions works correctly"""
         # Mock the model to return a predictable embedding
         mock_embedding = np.random.rand(384)
-        self.service._model.encode = lambda x: [mock_embedding]
+        self.service._model.encode = lambda texts, **kwargs: [mock_embedding]
         
         # Set both cluster embeddings to be similar to our mock
-        self.cluster1.embedding = pickle.dumps(mock_embedding)
+        self.cluster1.embedding = embedding_to_bytes(mock_embedding)
         self.cluster1.save()
-        self.cluster2.embedding = pickle.dumps(mock_embedding)
+        self.cluster2.embedding = embedding_to_bytes(mock_embedding)
         self.cluster2.save()
         
         result = self.service.find_multiple_cluster_suggestions(
@@ -118,13 +119,13 @@ class ConfigSuggestionServiceTest(TestCase):
             error_count=1,
             first_seen=timezone.now(),
             last_seen=timezone.now(),
-            embedding=pickle.dumps(np.random.rand(384))
+            embedding=embedding_to_bytes(np.random.rand(384))
         )
         
         # Mock the model
         mock_embedding = np.random.rand(384)
-        self.service._model.encode = lambda x: [mock_embedding]
-        empty_cluster.embedding = pickle.dumps(mock_embedding)
+        self.service._model.encode = lambda texts, **kwargs: [mock_embedding]
+        empty_cluster.embedding = embedding_to_bytes(mock_embedding)
         empty_cluster.save()
         
         result = self.service.find_config_suggestion(
@@ -180,7 +181,134 @@ class ConfigSuggestionServiceTest(TestCase):
         }
         self.assertEqual(parsed, expected)
         
+        # Test edge specs: the first operator tried that is present splits
+        # the spec, whitespace and extras are kept verbatim
+        edge_packages = [
+            "wheel @ https://example.com/wheel.whl",
+            "six===1.16.0",
+            "requests[socks]==2.32.4",
+            "idna >= 3.0",
+            "attrs>21,==23.1",
+            "click>7,<=8.1",
+            "rich~=13.0",
+        ]
+        parsed = command._parse_packages(edge_packages)
+        expected = {
+            "wheel @ https://example.com/wheel.whl": "unknown",
+            "six": "=1.16.0",
+            "requests[socks]": "2.32.4",
+            "idna ": ">= 3.0",
+            "attrs>21,": "23.1",
+            "click>7,": "<=8.1",
+            "rich~=13.0": "unknown",
+        }
+        self.assertEqual(parsed, expected)
+        
         # Test empty/None cases
         self.assertEqual(command._parse_packages(None), {})
         self.assertEqual(command._parse_packages([]), {})
         self.assertEqual(command._parse_packages({}), {})
+
+
+class ClusterEmbeddingsTest(TestCase):
+    def test_matches_dbscan_min_samples_two(self):
+        """Test that connected components over the eps-graph reproduce cosine DBSCAN"""
+        from analysis.management.commands.run_analysis import _cluster_embeddings
+        
+        embeddings = np.array([
+            [1.0, 0.0, 0.0],
+            [0.99, 0.14, 0.0],   # close to row 0
+            [0.0, 1.0, 0.0],
+            [0.0, 0.99, 0.14],   # close to row 2
+            [0.0, 0.0, 1.0],     # isolated -> noise
+        ], dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        
+        labels = _cluster_embeddings(embeddings, eps=0.3, block_size=2)
+        
+        self.assertEqual(labels[0], labels[1])
+        self.assertEqual(labels[2], labels[3])
+        self.assertNotEqual(labels[0], labels[2])
+        self.assertEqual(labels[4], -1)
+    
+    def test_repeated_rows_are_not_noise(self):
+        """Test that a deduplicated row standing for several errors forms its own cluster"""
+        from analysis.management.commands.run_analysis import _cluster_embeddings
+        
+        embeddings = np.eye(3, dtype=np.float32)
+        
+        labels = _cluster_embeddings(embeddings, eps=0.3, counts=np.array([1, 2, 1]))
+        
+        self.assertEqual(labels[0], -1)
+        self.assertNotEqual(labels[1], -1)
+        self.assertEqual(labels[2], -1)
+    
+    def test_dense_graph_matches_unbounded_edges(self):
+        """Test that collapsing a dense edge list to a spanning forest keeps the same partition"""
+        from analysis.management.commands.run_analysis import _cluster_embeddings
+        
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((3, 16))
+        embeddings = np.repeat(centers, 12, axis=0) + rng.standard_normal((36, 16)) * 0.01
+        embeddings = np.vstack([embeddings, rng.standard_normal((4, 16))]).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        
+        # Reference: every pairwise edge kept
+        adjacent = (embeddings @ embeddings.T) >= 0.7
+        np.fill_diagonal(adjacent, False)
+        
+        labels = _cluster_embeddings(embeddings, eps=0.3, block_size=4)
+        
+        for i in range(len(embeddings)):
+            if not adjacent[i].any():
+                self.assertEqual(labels[i], -1)
+            for j in np.flatnonzero(adjacent[i]):
+                self.assertEqual(labels[i], labels[j])
+        self.assertEqual(len(set(labels[:36])), 3)
+
+
+class QuantizedRankingTest(TestCase):
+    def test_int8_screening_matches_exact_ranking(self):
+        """Test that the int8 screening pass plus exact rescoring ranks like float32"""
+        from unittest import mock
+        from analysis import services
+        
+        rng = np.random.default_rng(0)
+        query = rng.standard_normal(384)
+        for i in range(50):
+            embedding = query + rng.standard_normal(384) * rng.uniform(0.1, 3)
+            ErrorCluster.objects.create(
+                cluster_hash=f"quantized_{i}",
+                error_signature=f"TestError: {i}",
+                error_count=1,
+                first_seen=timezone.now(),
+                last_seen=timezone.now(),
+                embedding=embedding_to_bytes(embedding / np.linalg.norm(embedding))
+            )
+        
+        query /= np.linalg.norm(query)  # encode() hands back unit-norm embeddings
+        
+        snapshot = services._get_snapshot()
+        self.assertIsNone(snapshot.scales)
+        exact = ConfigSuggestionService._rank_clusters(snapshot, query, 0.5, 5)
+        
+        with mock.patch.object(services, '_QUANTIZE_MIN_CLUSTERS', 1):
+            services._SNAPSHOT = None
+            snapshot = services._get_snapshot()
+            self.assertEqual(snapshot.matrix.dtype, np.int8)
+            screened = ConfigSuggestionService._rank_clusters(snapshot, query, 0.5, 5)
+        services._SNAPSHOT = None
+        
+        self.assertTrue(exact)
+        self.assertEqual([cid for cid, _ in screened], [cid for cid, _ in exact])
+        for (_, a), (_, b) in zip(screened, exact):
+            self.assertAlmostEqual(a, b, places=4)
+
+
+class SnapshotInvalidationTest(TestCase):
+    def test_cluster_deletes_have_no_receiver(self):
+        """Test that no post_delete receiver stops the bulk cluster delete in run_analysis"""
+        from django.db.models.signals import post_delete, post_save
+        
+        self.assertTrue(post_save.has_listeners(ErrorCluster))
+        self.assertFalse(post_delete.has_listeners(ErrorCluster))
@@ -0,0 +1,44 @@
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+_HANDLERS = []  # every BackgroundStreamHandler in this process, for the fork hook
+
+
+class BackgroundStreamHandler(QueueHandler):
+    """
+    Log handler that only enqueues on the calling thread; a QueueListener
+    thread writes the records to stderr, so request threads never block on I/O.
+    A forked child (gunicorn --preload) gets its own queue and listener.
+    """
+
+    def __init__(self):
+        super().__init__(queue.SimpleQueue())
+        self._start_listener()
+        _HANDLERS.append(self)
+        # Flush whatever is still queued when the process exits
+        atexit.register(self._stop_listener)
+
+    def _start_listener(self):
+        self._listener = QueueListener(self.queue, logging.StreamHandler())
+        self._listener.start()
+
+    def _stop_listener(self):
+        self._listener.stop()
+
+    def _restart_after_fork(self):
+        # The parent's listener thread didn't survive the fork; records the
+        # parent had queued are the parent's to write
+        self.queue = queue.SimpleQueue()
+        self._start_listener()
+
+
+def _restart_listeners():
+    for handler in _HANDLERS:
+        handler._restart_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners)
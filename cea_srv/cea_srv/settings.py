@@ -125,7 +125,42 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# env_hash_idx carries INCLUDE (id) for index-only scans on PostgreSQL;
+# SQLite ignores it, which is fine since its indexes already hold the rowid
+SILENCED_SYSTEM_CHECKS = ["models.W040"]
+
+# Shared by the telemetry views (known env hashes, /suggest payloads).
+# Per-process locmem by default; point at Redis to share across workers, e.g.
+# {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://127.0.0.1:6379"}
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "cea-srv",
+    }
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [],   # no SessionAuth → no CSRF
+    "DEFAULT_RENDERER_CLASSES": [
+        "telemetry.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+CSRF_TRUSTED_ORIGINS = ["http://127.0.0.1:8000"]
+
+# Warnings and errors from the apps go through a queue; a listener thread
+# does the writing so request threads don't block on stderr
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "plain": {"format": "%(asctime)s %(levelname)s %(name)s: %(message)s"},
+    },
+    "handlers": {
+        "background": {"class": "cea_srv.log_queue.BackgroundStreamHandler", "formatter": "plain"},
+    },
+    "loggers": {
+        "analysis": {"handlers": ["background"], "level": "WARNING"},
+        "telemetry": {"handlers": ["background"], "level": "WARNING"},
+    },
 }
-CSRF_TRUSTED_ORIGINS = ["http://127.0.0.1:8000"]
\ No newline at end of file
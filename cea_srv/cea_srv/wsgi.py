@@ -14,3 +14,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cea_srv.settings")
 
 application = get_wsgi_application()
+
+# Apps and the database are available from here on: hand the service to
+# the view and warm the /suggest path before the first request arrives.
+# Warmup runs a torch encode, whose OpenMP/MKL thread pools don't survive a
+# fork: when this module is imported in a preloading master (gunicorn
+# --preload), set CEA_WARMUP_AT_IMPORT=0 and warm up in each worker instead,
+# e.g. from a gunicorn post_fork hook (see README).
+from analysis.services import get_suggestion_service  # noqa: E402
+from telemetry.views import SuggestView  # noqa: E402
+
+SuggestView.suggestion_service = get_suggestion_service()
+if os.environ.get("CEA_WARMUP_AT_IMPORT", "1") != "0":
+    SuggestView.suggestion_service.warmup()
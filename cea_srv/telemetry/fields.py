@@ -0,0 +1,44 @@
+import json
+
+import orjson
+from django.db import models
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class OrjsonEncoder(json.JSONEncoder):
+    """json.JSONEncoder whose encode() runs orjson; stdlib json handles what orjson can't (e.g. >64-bit ints)"""
+
+    def encode(self, o):
+        try:
+            return orjson.dumps(o, option=_ORJSON_OPTIONS).decode()
+        except orjson.JSONEncodeError:
+            return super().encode(o)
+
+
+class OrjsonDecoder(json.JSONDecoder):
+    """json.JSONDecoder whose decode() runs orjson; orjson.JSONDecodeError subclasses json's"""
+
+    def decode(self, s, *args, **kwargs):
+        return orjson.loads(s)
+
+
+class OrjsonJSONField(models.JSONField):
+    """
+    JSONField that (de)serializes through orjson. Django's JSONField already
+    routes every json.dumps/json.loads through its encoder/decoder, so the
+    vendor-specific lookup and adaptation logic is left untouched.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("encoder", OrjsonEncoder)
+        kwargs.setdefault("decoder", OrjsonDecoder)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get("encoder") is OrjsonEncoder:
+            del kwargs["encoder"]
+        if kwargs.get("decoder") is OrjsonDecoder:
+            del kwargs["decoder"]
+        return name, path, args, kwargs
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-14 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("telemetry", "0002_delete_errorsuggestion"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="beacon",
+            index=models.Index(fields=["kind"], name="telemetry_b_kind_2ff32e_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="beacon",
+            index=models.Index(
+                fields=["env_hash"], name="telemetry_b_env_has_557d04_idx"
+            ),
+        ),
+    ]
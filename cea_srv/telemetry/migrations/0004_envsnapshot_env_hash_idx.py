@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-14 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("telemetry", "0003_beacon_kind_env_hash_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="envsnapshot",
+            index=models.Index(fields=["env_hash"], name="env_hash_idx"),
+        ),
+    ]
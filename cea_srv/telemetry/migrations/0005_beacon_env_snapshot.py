@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-14 18:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def link_beacons_to_snapshots(apps, schema_editor):
+    """Backfill env_snapshot from the existing env_hash matches in one UPDATE"""
+    Beacon = apps.get_model("telemetry", "Beacon")
+    EnvSnapshot = apps.get_model("telemetry", "EnvSnapshot")
+    first_snapshot = (
+        EnvSnapshot.objects.filter(env_hash=OuterRef("env_hash"))
+        .order_by("id")
+        .values("id")[:1]
+    )
+    Beacon.objects.filter(env_snapshot__isnull=True).update(
+        env_snapshot_id=Subquery(first_snapshot)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("telemetry", "0004_envsnapshot_env_hash_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="beacon",
+            name="env_snapshot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="beacons",
+                to="telemetry.envsnapshot",
+            ),
+        ),
+        migrations.RunPython(link_beacons_to_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-14 18:33
+
+import telemetry.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("telemetry", "0005_beacon_env_snapshot"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="envsnapshot",
+            name="env_vars",
+            field=telemetry.fields.OrjsonJSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="envsnapshot",
+            name="packages",
+            field=telemetry.fields.OrjsonJSONField(),
+        ),
+    ]
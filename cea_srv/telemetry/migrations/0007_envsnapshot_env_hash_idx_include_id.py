@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-14 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("telemetry", "0006_envsnapshot_orjson_fields"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="envsnapshot",
+            name="env_hash_idx",
+        ),
+        migrations.AddIndex(
+            model_name="envsnapshot",
+            index=models.Index(
+                fields=["env_hash"], include=("id",), name="env_hash_idx"
+            ),
+        ),
+    ]
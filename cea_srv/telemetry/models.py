@@ -1,29 +1,124 @@
-from django.db import models
+from django.db import connections, models, transaction
+from .fields import OrjsonJSONField
+
+# Backends whose INSERT takes ON CONFLICT ... DO NOTHING RETURNING
+_ON_CONFLICT_VENDORS = ("sqlite", "postgresql")
+
+
+class EnvSnapshotManager(models.Manager):
+    def insert_if_absent(self, **fields):
+        """
+        Store a snapshot unless (env_hash, machine_arch) is already there.
+        A single INSERT ... ON CONFLICT DO NOTHING RETURNING id does both the
+        check and the write. Returns (id, created).
+        """
+        connection = connections[self.db]
+        # MySQL/MariaDB and Oracle report RETURNING and ignore-conflicts
+        # support but accept neither ON CONFLICT nor a bare RETURNING
+        if not (connection.vendor in _ON_CONFLICT_VENDORS and connection.features.can_return_columns_from_insert):
+            obj, created = self.get_or_create(
+                env_hash=fields["env_hash"], machine_arch=fields["machine_arch"], defaults=fields
+            )
+            return obj.id, created
+
+        snapshot = self.model(**fields)
+        qn = connection.ops.quote_name
+        columns = [f for f in self.model._meta.concrete_fields if not f.primary_key]
+        params = [f.get_db_prep_save(f.pre_save(snapshot, True), connection) for f in columns]
+        sql = (
+            f"INSERT INTO {qn(self.model._meta.db_table)} "
+            f"({', '.join(qn(f.column) for f in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({qn('env_hash')}, {qn('machine_arch')}) DO NOTHING "
+            f"RETURNING {qn('id')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is not None:
+            return row[0], True
+        # Lost a race with a concurrent post of the same snapshot
+        existing = self.filter(env_hash=fields["env_hash"], machine_arch=fields["machine_arch"])
+        return existing.values_list("id", flat=True).get(), False
+
 
 class EnvSnapshot(models.Model):
     id           = models.BigAutoField(primary_key=True)    
     env_hash     = models.CharField(max_length=12)
     machine_arch = models.CharField(max_length=20)          
-    packages     = models.JSONField()
+    packages     = OrjsonJSONField()
     python_ver   = models.CharField(max_length=20)
     os_info      = models.CharField(max_length=120)
-    env_vars     = models.JSONField(null=True, blank=True)
+    env_vars     = OrjsonJSONField(null=True, blank=True)
     captured_at  = models.DateTimeField(auto_now_add=True)
 
+    objects = EnvSnapshotManager()
+
     class Meta:
         unique_together = ("env_hash", "machine_arch")
+        indexes = [
+            # INCLUDE makes beacon lookups index-only on PostgreSQL; other
+            # backends ignore it (SQLite indexes already carry the rowid)
+            models.Index(fields=["env_hash"], include=["id"], name="env_hash_idx"),
+        ]
+
+
+class BeaconManager(models.Manager):
+    def create_linked(self, **fields):
+        """
+        Create a beacon with env_snapshot resolved from its env_hash in the
+        same statement: INSERT ... VALUES (..., (SELECT id ...)) RETURNING.
+        One round-trip instead of a lookup followed by the insert.
+        """
+        beacon = self.model(**fields)
+        connection = connections[self.db]
+        if not connection.features.can_return_columns_from_insert:
+            with transaction.atomic(using=self.db):
+                beacon.env_snapshot_id = (
+                    EnvSnapshot.objects.using(self.db)
+                    .filter(env_hash=beacon.env_hash)
+                    .values_list("id", flat=True)
+                    .first()
+                )
+                beacon.save(using=self.db)
+            return beacon
+
+        qn = connection.ops.quote_name
+        fk = self.model._meta.get_field("env_snapshot")
+        columns = [f for f in self.model._meta.concrete_fields if not f.primary_key and f is not fk]
+        params = [f.get_db_prep_save(getattr(beacon, f.attname), connection) for f in columns]
+        sql = (
+            f"INSERT INTO {qn(self.model._meta.db_table)} "
+            f"({', '.join(qn(f.column) for f in columns)}, {qn(fk.column)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}, "
+            f"(SELECT {qn('id')} FROM {qn(EnvSnapshot._meta.db_table)} WHERE {qn('env_hash')} = %s LIMIT 1)) "
+            f"RETURNING {qn('id')}, {qn(fk.column)}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [beacon.env_hash])
+            beacon.id, beacon.env_snapshot_id = cursor.fetchone()
+        beacon._state.adding = False
+        beacon._state.db = self.db
+        return beacon
 
 
 class Beacon(models.Model):
     KIND = [("error", "error"), ("success", "success")]
     kind       = models.CharField(max_length=7, choices=KIND)
     env_hash   = models.CharField(max_length=12)
+    env_snapshot = models.ForeignKey(
+        EnvSnapshot, null=True, blank=True, on_delete=models.SET_NULL, related_name="beacons"
+    )  # Filled from env_hash on ingest, or when the snapshot arrives later
     script_id  = models.CharField(max_length=12)
     error_sig  = models.TextField(null=True, blank=True)
     trace      = models.TextField(null=True, blank=True)
     ts         = models.DateTimeField()
 
+    objects = BeaconManager()
+
     class Meta:
         indexes = [
             models.Index(fields=["error_sig", "env_hash"]),
+            models.Index(fields=["kind"]),
+            models.Index(fields=["env_hash"]),
         ]
@@ -0,0 +1,21 @@
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Matches DRF's JSONRenderer output: compact, UTF-8, UTC datetimes as "...Z"
+_ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class ORJSONRenderer(BaseRenderer):
+    """Drop-in for DRF's JSONRenderer that encodes with orjson"""
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    # Types orjson doesn't know natively (Decimal, lazy strings, ...) fall back to DRF's encoder
+    _default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return orjson.dumps(data, default=self._default, option=_ORJSON_OPTIONS)
@@ -0,0 +1,72 @@
+"""
+Request bodies for /env and /beacon, validated in pydantic-core.
+
+Mirrors what the DRF ModelSerializers accepted: strings are stripped and
+length-checked against the model columns, numbers are accepted for string
+fields, unknown keys are ignored.
+"""
+from datetime import datetime, timezone as dt_timezone
+from typing import Annotated, Any, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, StringConstraints, TypeAdapter, field_validator, model_validator
+
+
+def _required_str(max_length):
+    return Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=max_length)]
+
+
+_OptionalText = Optional[Annotated[str, StringConstraints(strip_whitespace=True)]]
+
+
+class _Body(BaseModel):
+    model_config = ConfigDict(frozen=True, coerce_numbers_to_str=True)
+
+
+class EnvBody(_Body):
+    env_hash: _required_str(12)
+    machine_arch: _required_str(20)
+    packages: Any
+    python_ver: _required_str(20)
+    os_info: _required_str(120)
+    env_vars: Any = None
+
+    @field_validator("packages")
+    @classmethod
+    def _packages_not_null(cls, value):
+        if value is None:
+            raise ValueError("This field may not be null.")
+        return value
+
+
+class BeaconBody(_Body):
+    kind: Literal["error", "success"]
+    env_hash: _required_str(12)
+    script_id: _required_str(12)
+    error_sig: _OptionalText = None
+    trace: _OptionalText = None
+    ts: datetime  # ISO-8601 or epoch seconds
+
+    @field_validator("ts")
+    @classmethod
+    def _aware_ts(cls, value):
+        # Naive timestamps are UTC, as with TIME_ZONE = "UTC"
+        return value if value.tzinfo is not None else value.replace(tzinfo=dt_timezone.utc)
+
+    @model_validator(mode="after")
+    def _error_needs_detail(self):
+        if self.kind == "error" and not (self.error_sig or self.trace):
+            raise ValueError("For kind='error' you must supply error_sig or trace.")
+        return self
+
+
+# A batch of beacons posted as one JSON array
+BeaconBatch = TypeAdapter(list[BeaconBody])
+
+
+def error_dict(exc):
+    """A pydantic ValidationError shaped like DRF serializer errors: {field: [message, ...]}"""
+    errors = {}
+    for err in exc.errors(include_url=False):
+        field = ".".join(str(part) for part in err["loc"]) or "non_field_errors"
+        errors.setdefault(field, []).append(err["msg"])
+    return errors
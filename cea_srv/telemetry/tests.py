@@ -1,3 +1,452 @@
+import json
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+import numpy as np
+from analysis import services
+from analysis.embeddings import embedding_to_bytes
+from analysis.models import ErrorCluster, ConfigPattern
+from analysis.services import ConfigSuggestionService
+from telemetry.models import Beacon, EnvSnapshot
+
+ENV = {
+    "env_hash": "abc123def456",
+    "machine_arch": "x86_64",
+    "packages": {"numpy": "1.19.0"},
+    "python_ver": "3.8",
+    "os_info": "Linux",
+    "env_vars": {"CI": "1"},
+}
+
+BEACON = {
+    "kind": "error",
+    "env_hash": "abc123def456",
+    "script_id": "script000001",
+    "error_sig": "ZeroDivisionError: division by zero",
+    "ts": 1700000000,
+}
+
+
+class TelemetryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()  # env ids and /suggest payloads live in the shared cache
+
+    def post_json(self, path, body, **headers):
+        raw = body if isinstance(body, str) else json.dumps(body)
+        return self.client.post(path, raw, content_type="application/json", headers=headers)
+
+
+class EnvViewTest(TelemetryTestCase):
+    def test_new_snapshot_is_stored_once(self):
+        """Test that the first post stores the snapshot and a repeat does not"""
+        self.assertEqual(self.post_json("/env", ENV).json(), {"stored": True})
+        self.assertEqual(self.post_json("/env", ENV).json(), {"stored": False})
+        self.assertEqual(EnvSnapshot.objects.count(), 1)
+
+    def test_invalid_body_returns_field_errors(self):
+        """Test that validation errors come back as a 400 of {field: [messages]}"""
+        response = self.post_json("/env", {"env_hash": "abc123def456", "machine_arch": "x86_64"})
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(set(errors), {"packages", "python_ver", "os_info"})
+        for messages in errors.values():
+            self.assertIsInstance(messages, list)
+            self.assertTrue(all(isinstance(m, str) for m in messages))
+
+    def test_invalid_body_for_known_snapshot_is_rejected(self):
+        """Test that a known (env_hash, machine_arch) does not let a malformed body through"""
+        self.post_json("/env", ENV)
+
+        response = self.post_json("/env", {**ENV, "os_info": None})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("os_info", response.json())
+
+    def test_length_and_null_checks(self):
+        """Test that column lengths and the non-null packages rule are enforced"""
+        response = self.post_json("/env", {**ENV, "env_hash": "x" * 13, "packages": None})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"env_hash", "packages"})
+        self.assertFalse(EnvSnapshot.objects.exists())
+
+    def test_non_object_body(self):
+        """Test that a JSON body that isn't an object is a 400 under non_field_errors"""
+        response = self.post_json("/env", [ENV])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["non_field_errors"])
+
+    def test_unparseable_body(self):
+        """Test that a body that isn't JSON is a 400 with a parse error detail"""
+        response = self.post_json("/env", "{not json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.json()["detail"])
+
+    def test_snapshot_links_earlier_beacons(self):
+        """Test that beacons posted before their snapshot are linked once it arrives"""
+        self.post_json("/beacon", BEACON)
+
+        self.post_json("/env", ENV)
+
+        snapshot = EnvSnapshot.objects.get()
+        self.assertEqual(list(Beacon.objects.values_list("env_snapshot_id", flat=True)), [snapshot.id])
+
+
+class BeaconViewTest(TelemetryTestCase):
+    def test_need_env_status(self):
+        """Test that a beacon answers 204 while its snapshot is missing and 200 once known"""
+        self.assertEqual(self.post_json("/beacon", BEACON).status_code, 204)
+        self.post_json("/env", ENV)
+        self.assertEqual(self.post_json("/beacon", BEACON).status_code, 200)
+
+    def test_deleted_snapshot_is_evicted_from_the_cache(self):
+        """Test that deleting a known snapshot sends its beacons back to need_env, not a 500"""
+        self.post_json("/env", ENV)
+        self.assertEqual(self.post_json("/beacon", BEACON).status_code, 200)
+
+        EnvSnapshot.objects.get().delete()
+
+        self.assertEqual(self.post_json("/beacon", BEACON).status_code, 204)
+        self.assertEqual(self.post_json("/beacon", [BEACON]).json(), [{"need_env": True}])
+
+    def test_invalid_body_returns_400_with_field_errors(self):
+        """Test that an invalid beacon is a 400 {"error": ...}, like an unparseable one"""
+        response = self.post_json("/beacon", {**BEACON, "kind": "crash"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'kind'", response.json()["error"])
+        self.assertFalse(Beacon.objects.exists())
+
+    def test_invalid_body_logs_a_warning_without_traceback(self):
+        """Test that a client's bad beacon is a one-line warning, not an ERROR traceback"""
+        with self.assertLogs("telemetry.views", level="WARNING") as logs:
+            self.post_json("/beacon", {**BEACON, "kind": "crash"})
+            self.post_json("/beacon", [{**BEACON, "kind": "crash"}])
+
+        self.assertEqual([r.levelname for r in logs.records], ["WARNING", "WARNING"])
+        self.assertTrue(all(r.exc_info is None for r in logs.records))
+
+    def test_server_error_logs_the_traceback(self):
+        """Test that a failure after validation still returns 500 and logs the exception"""
+        with mock.patch.object(Beacon.objects, "create_linked", side_effect=RuntimeError("db down")), \
+                self.assertLogs("telemetry.views", level="ERROR") as logs:
+            response = self.post_json("/beacon", BEACON)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {"error": "db down"})
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+    def test_error_beacon_needs_sig_or_trace(self):
+        """Test that kind=error without error_sig or trace is rejected"""
+        response = self.post_json("/beacon", {**BEACON, "error_sig": None})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("must supply error_sig or trace", response.json()["error"])
+
+    def test_unparseable_body(self):
+        """Test that a body that isn't JSON is a 400 with a parse error detail"""
+        response = self.post_json("/beacon", "{not json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.json()["detail"])
+
+    def test_single_object_body_is_stored(self):
+        """Test that a single JSON object is still accepted, with the bodiless 204/200 reply"""
+        response = self.post_json("/beacon", BEACON)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.content, b"")
+        beacon = Beacon.objects.get()
+        self.assertEqual(beacon.error_sig, BEACON["error_sig"])
+        self.assertEqual(beacon.ts, datetime.fromtimestamp(BEACON["ts"], dt_timezone.utc))
+
+    def test_batch_with_known_and_unknown_envs(self):
+        """Test that a batch is stored in one go and reports need_env per beacon, in order"""
+        snapshot = EnvSnapshot.objects.create(**ENV)
+        batch = [
+            BEACON,
+            {**BEACON, "env_hash": "fedcba654321"},
+            {**BEACON, "kind": "success", "error_sig": None, "ts": "2024-01-01T00:00:00Z"},
+        ]
+
+        response = self.post_json("/beacon", batch)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"need_env": False}, {"need_env": True}, {"need_env": False}])
+        linked = dict(Beacon.objects.values_list("env_hash", "env_snapshot_id").distinct())
+        self.assertEqual(linked, {ENV["env_hash"]: snapshot.id, "fedcba654321": None})
+        self.assertEqual(Beacon.objects.count(), 3)
+
+    def test_empty_batch(self):
+        """Test that an empty array stores nothing and answers an empty list"""
+        response = self.post_json("/beacon", [])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        self.assertFalse(Beacon.objects.exists())
+
+    def test_batch_with_an_invalid_beacon_stores_nothing(self):
+        """Test that one invalid element rejects the whole batch, naming its index"""
+        response = self.post_json("/beacon", [BEACON, {**BEACON, "kind": "crash"}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'1.kind'", response.json()["error"])
+        self.assertFalse(Beacon.objects.exists())
+
+    def test_get_not_allowed(self):
+        """Test that only POST is routed"""
+        self.assertEqual(self.client.get("/beacon").status_code, 405)
+
+
+class EnvSnapshotManagerTest(TestCase):
+    def test_first_insert_returns_new_id(self):
+        """Test that a new snapshot is inserted and its id returned"""
+        env_id, created = EnvSnapshot.objects.insert_if_absent(**ENV)
+
+        self.assertTrue(created)
+        self.assertEqual(EnvSnapshot.objects.get().id, env_id)
+        self.assertEqual(EnvSnapshot.objects.get().packages, ENV["packages"])
+
+    def test_duplicate_returns_existing_id(self):
+        """Test that ON CONFLICT DO NOTHING falls back to looking up the stored id"""
+        existing = EnvSnapshot.objects.create(**ENV)
+
+        env_id, created = EnvSnapshot.objects.insert_if_absent(**{**ENV, "python_ver": "3.12"})
+
+        self.assertFalse(created)
+        self.assertEqual(env_id, existing.id)
+        self.assertEqual(EnvSnapshot.objects.get().python_ver, "3.8")
+
+    def test_same_hash_other_arch_is_a_new_snapshot(self):
+        """Test that the conflict target is (env_hash, machine_arch), not env_hash alone"""
+        EnvSnapshot.objects.insert_if_absent(**ENV)
+
+        _, created = EnvSnapshot.objects.insert_if_absent(**{**ENV, "machine_arch": "arm64"})
+
+        self.assertTrue(created)
+        self.assertEqual(EnvSnapshot.objects.count(), 2)
+
+    def test_get_or_create_fallback_on_other_backends(self):
+        """Test that backends without ON CONFLICT syntax go through get_or_create"""
+        with mock.patch.object(connection, "vendor", "mysql"), \
+                mock.patch.object(EnvSnapshot.objects, "get_or_create", wraps=EnvSnapshot.objects.get_or_create) as get_or_create:
+            first_id, first_created = EnvSnapshot.objects.insert_if_absent(**ENV)
+            second_id, second_created = EnvSnapshot.objects.insert_if_absent(**ENV)
+
+        self.assertEqual(get_or_create.call_count, 2)
+        self.assertEqual((first_created, second_created), (True, False))
+        self.assertEqual(first_id, second_id)
+
+
+class BeaconManagerTest(TestCase):
+    def beacon_fields(self, env_hash="abc123def456"):
+        return {
+            "kind": "error",
+            "env_hash": env_hash,
+            "script_id": "script000001",
+            "error_sig": "ZeroDivisionError: division by zero",
+            "trace": None,
+            "ts": datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        }
+
+    def assert_linked(self, env_hash, expected_env_id):
+        beacon = Beacon.objects.create_linked(**self.beacon_fields(env_hash))
+
+        self.assertIsNotNone(beacon.pk)
+        self.assertFalse(beacon._state.adding)
+        self.assertEqual(beacon.env_snapshot_id, expected_env_id)
+        stored = Beacon.objects.get(pk=beacon.pk)
+        self.assertEqual(stored.env_snapshot_id, expected_env_id)
+        self.assertEqual(stored.error_sig, "ZeroDivisionError: division by zero")
+
+    def test_known_env_is_linked(self):
+        """Test that the INSERT resolves env_snapshot from a stored env_hash"""
+        snapshot = EnvSnapshot.objects.create(**ENV)
+        self.assert_linked(ENV["env_hash"], snapshot.id)
+
+    def test_unknown_env_leaves_fk_null(self):
+        """Test that a beacon for an env nobody has posted yet is stored unlinked"""
+        EnvSnapshot.objects.create(**ENV)
+        self.assert_linked("fedcba654321", None)
+
+    def test_fallback_without_insert_returning(self):
+        """Test the lookup-then-save path on backends that can't RETURNING from an INSERT"""
+        snapshot = EnvSnapshot.objects.create(**ENV)
+        with mock.patch.object(connection.features, "can_return_columns_from_insert", False):
+            self.assert_linked(ENV["env_hash"], snapshot.id)
+            self.assert_linked("fedcba654321", None)
+
+
+class _FakeEncoder:
+    """Stands in for the sentence encoder: every text embeds to the same unit vector"""
+    max_seq_length = 64
+
+    def __init__(self, embedding):
+        self.embedding = embedding
+
+    def encode(self, texts, **kwargs):
+        return np.tile(self.embedding, (len(texts), 1))
+
+
+class SuggestViewTest(TelemetryTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        embedding = rng.standard_normal(384).astype(np.float32)
+        embedding /= np.linalg.norm(embedding)
+        patcher = mock.patch.object(ConfigSuggestionService, "_model", _FakeEncoder(embedding))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        services._encode_cached.cache_clear()
+        services._SNAPSHOT = None  # a rolled-back test's clusters fire no signal
+        self.embedding = embedding
+
+        self.cluster = self.create_cluster("ValueError: invalid literal for int()")
+        self.add_pattern(self.cluster, "python_ver", "3.8")
+
+    def create_cluster(self, signature):
+        return ErrorCluster.objects.create(
+            cluster_hash=signature[:32],
+            error_signature=signature,
+            error_count=4,
+            first_seen=timezone.now(),
+            last_seen=timezone.now(),
+            embedding=embedding_to_bytes(self.embedding),
+        )
+
+    def add_pattern(self, cluster, config_key, config_value):
+        ConfigPattern.objects.create(
+            cluster=cluster,
+            config_key=config_key,
+            config_value=config_value,
+            occurrence_rate=0.9,
+            global_rate=0.3,
+            significance_score=3.0,
+        )
+
+    def suggest(self, if_none_match=None, **body):
+        headers = {"If-None-Match": if_none_match} if if_none_match else {}
+        return self.post_json("/suggest", {"error_sig": "ValueError: bad input", **body}, **headers)
+
+    def count_lookups(self):
+        return mock.patch.object(
+            ConfigSuggestionService, "find_config_suggestion",
+            autospec=True, side_effect=ConfigSuggestionService.find_config_suggestion,
+        )
+
+    def test_repeat_is_served_from_cache(self):
+        """Test that the (digest, payload) entry stored on a miss answers the next request"""
+        with self.count_lookups() as lookup:
+            first = self.suggest()
+            second = self.suggest()
+
+        self.assertEqual(lookup.call_count, 1)
+        self.assertTrue(first.json()["match"])
+        self.assertEqual(second.json(), first.json())
+
+    def test_failed_encode_is_not_cached(self):
+        """Test that an encode failure is a 500 and the next request is computed afresh"""
+        with mock.patch.object(
+            services, "_encode_cached", side_effect=[RuntimeError("encode timed out"), self.embedding.tobytes()]
+        ), self.assertLogs("telemetry.views", level="ERROR"):
+            failed = self.suggest()
+            retried = self.suggest()
+
+        self.assertEqual(failed.status_code, 500)
+        self.assertEqual(failed.json(), {"error": "encode timed out"})
+        self.assertTrue(retried.json()["match"])
+
+    def test_new_cluster_bypasses_cached_payload(self):
+        """Test that a re-analysed cluster set changes the fingerprint and so misses the cache"""
+        first = self.suggest()
+        self.assertIn("Python 3.8", first.json()["recommendation"])
+
+        newer = self.create_cluster("ValueError: bad input")
+        self.add_pattern(newer, "python_ver", "3.12")
+
+        with self.count_lookups() as lookup:
+            second = self.suggest()
+
+        self.assertEqual(lookup.call_count, 1)
+        self.assertIn("Python 3.12", second.json()["recommendation"])
+
+    def test_etag_is_stable_for_the_same_payload(self):
+        """Test that the ETag is a content hash: recomputing the payload gives the same tag"""
+        first = self.suggest()
+        cache.clear()
+        second = self.suggest()
+
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_etag_differs_per_representation(self):
+        """Test that the text, json and textonly bodies of one payload carry distinct ETags"""
+        etags = [
+            self.suggest()["ETag"],
+            self.suggest(format_response=False)["ETag"],
+            self.suggest(text_only=True)["ETag"],
+        ]
+
+        self.assertEqual(len(set(etags)), 3)
+        self.assertEqual(len({etag.split("-")[0] for etag in etags}), 1)
+
+    def test_matching_if_none_match_is_not_modified(self):
+        """Test that re-polling with the current ETag gets a bodiless 304"""
+        etag = self.suggest()["ETag"]
+
+        response = self.suggest(if_none_match=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_stale_if_none_match_gets_the_body(self):
+        """Test that another representation's ETag doesn't produce a 304"""
+        json_etag = self.suggest(format_response=False)["ETag"]
+
+        response = self.suggest(if_none_match=json_etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("formatted_text", response.json())
+
+    def test_etag_changes_with_the_cluster_set(self):
+        """Test that a new cluster changing the answer changes the ETag, so old tags stop matching"""
+        etag = self.suggest()["ETag"]
+
+        newer = self.create_cluster("ValueError: bad input")
+        self.add_pattern(newer, "python_ver", "3.12")
+        response = self.suggest(if_none_match=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_text_only_drops_structured_lists(self):
+        """Test that text_only returns just match, confidence and the full response's formatted_text"""
+        full = self.suggest()
+        text_only = self.suggest(text_only=True)
+
+        self.assertEqual(set(text_only.json()), {"match", "confidence", "formatted_text"})
+        self.assertEqual(text_only.json()["formatted_text"], full.json()["formatted_text"])
+        self.assertEqual(text_only.json()["confidence"], full.json()["confidence"])
+        self.assertIn("all_suggestions", full.json())
+        self.assertEqual(text_only["ETag"], full["ETag"].replace("-text", "-textonly"))
+
+    def test_text_only_without_match(self):
+        """Test that text_only leaves a no-match answer as it is"""
+        ErrorCluster.objects.all().delete()
+
+        response = self.suggest(text_only=True)
+
+        self.assertEqual(response.json(), {"match": False})
+
+    def test_error_sig_required(self):
+        """Test that a request without error_sig is a 400"""
+        response = self.post_json("/suggest", {})
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 400)
@@ -1,8 +1,8 @@
 from django.urls import path
-from .views import EnvView, BeaconView, SuggestView
+from .views import SuggestView, beacon_view, env_view
 
 urlpatterns = [
-    path("env", EnvView.as_view()),
-    path("beacon", BeaconView.as_view()),
+    path("env", env_view),
+    path("beacon", beacon_view),
     path("suggest", SuggestView.as_view()),
 ]
@@ -1,55 +1,243 @@
+import hashlib
+import logging
+import operator
+
+import orjson
+from pydantic import ValidationError
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from .models import EnvSnapshot, Beacon
-from .serializers import EnvSnapshotIn, BeaconIn
+from .schemas import BeaconBatch, BeaconBody, EnvBody, error_dict
+from .renderers import ORJSONRenderer
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from analysis.services import ConfigSuggestionService
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_POST
+from analysis.services import get_suggestion_service
 
-@method_decorator(csrf_exempt, name="dispatch")
-class EnvView(APIView):
-    def post(self, request):
-        ser = EnvSnapshotIn(data=request.data)
-        ser.is_valid(raise_exception=True)
-        obj, created = EnvSnapshot.objects.get_or_create(
-            env_hash     = ser.validated_data["env_hash"], # type: ignore
-            machine_arch = ser.validated_data["machine_arch"], # type: ignore
-            defaults     = ser.validated_data, # type: ignore
-        )
-        return Response({"stored": created})
-    
-@method_decorator(csrf_exempt, name="dispatch")
-class BeaconView(APIView):
-    def post(self, request):
-        try:
-            ser = BeaconIn(data=request.data)
-            ser.is_valid(raise_exception=True)
-            beacon = ser.save()                  
+log = logging.getLogger(__name__)
+
+# envsnap:<env_hash> -> EnvSnapshot id, in the shared Django cache so every
+# worker benefits once any of them has seen the snapshot. Only positive
+# answers are cached; deleting a snapshot (admin) evicts its key, see below.
+_ENV_CACHE_TTL = 3600
+
+# sugg:<digest> -> (ETag digest, /suggest payload with formatted_text).
+# Keyed on the cluster-set fingerprint, so entries go stale only through
+# admin edits to patterns; the TTL bounds that.
+_SUGGEST_CACHE_TTL = 300
+
+# Rows per INSERT when the agent posts a batch of beacons
+_BEACON_BATCH_SIZE = 1000
+
+# all_suggestions entries: these fields, in this order
+_SUG_FIELDS = ("suggestion", "config_key", "config_value", "confidence_percentage", "significance_score")
+_get_sug_fields = operator.itemgetter(*_SUG_FIELDS)
+
+# What a text_only /suggest response carries
+_TEXT_ONLY_FIELDS = ("match", "confidence", "formatted_text")
+
+# formatted_text building blocks
+_BAR = "─" * 72
+_DT_FMT = "%Y-%m-%d %H:%M"
+_CLUSTER_TMPL = "  [{idx}] {sim}% similar · {cnt} errors · {fs} → {ls}\n       signature: {sig}"
+_SUG_TMPL = "{i:2}. {txt}\n       -> {key} = {val}  (conf: {pct}%, score: {score:.2f})"
+
+
+def _env_cache_key(env_hash):
+    return f"envsnap:{env_hash}"
+
+
+def _cached_env_id(env_hash):
+    """EnvSnapshot id for env_hash if a worker has already seen it, else None"""
+    return cache.get(_env_cache_key(env_hash))
+
+
+def _mark_env_known(env_hash, env_id):
+    cache.set(_env_cache_key(env_hash), env_id, _ENV_CACHE_TTL)
+
+
+@receiver(post_delete, sender=EnvSnapshot)
+def _forget_env(sender, instance, **kwargs):
+    """A cached id for a deleted snapshot would fail every beacon's FK insert"""
+    cache.delete(_env_cache_key(instance.env_hash))
+
+
+def _suggest_cache_key(error_sig, use_multiple_clusters, clusters_version):
+    raw = f"{error_sig}|{use_multiple_clusters}|{clusters_version}"
+    return "sugg:" + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _payload_digest(suggestion_data):
+    """Content hash of a /suggest payload, for its ETag"""
+    return hashlib.blake2b(ORJSONRenderer().render(suggestion_data), digest_size=8).hexdigest()
+
+
+def _format_cluster(idx, c):
+    fs = c.get("first_seen", "unknown")
+    ls = c.get("last_seen", "unknown")
+    return _CLUSTER_TMPL.format(
+        idx=idx,
+        sim=int((c.get("similarity") or 0.0) * 100),
+        cnt=c.get("error_count", "?"),
+        fs=fs.strftime(_DT_FMT) if hasattr(fs, 'strftime') else fs,
+        ls=ls.strftime(_DT_FMT) if hasattr(ls, 'strftime') else ls,
+        sig=c.get("error_signature", "").strip(),
+    )
+
+
+def _format_suggestion(i, sug):
+    return _SUG_TMPL.format(
+        i=i,
+        txt=sug.get("suggestion", "").strip(),
+        key=sug.get("config_key", "unknown"),
+        val=sug.get("config_value", "unknown"),
+        pct=sug.get("confidence_percentage", 0),
+        score=sug.get("significance_score", 0.0),
+    )
+
+
+def _json_response(data, status=200):
+    return HttpResponse(ORJSONRenderer().render(data), status=status, content_type="application/json")
+
+
+def _parse_json_body(request):
+    """Decoded JSON body, or a 400 response if it doesn't parse"""
+    try:
+        return orjson.loads(request.body), None
+    except orjson.JSONDecodeError as e:
+        return None, _json_response({"detail": f"JSON parse error - {e}"}, status=400)
+
+
+def _json_error_response(exc):
+    """The 400 for a body pydantic couldn't parse as JSON, else None"""
+    for err in exc.errors(include_url=False):
+        if err["type"] == "json_invalid":
+            return _json_response({"detail": f"JSON parse error - {err['ctx']['error']}"}, status=400)
+    return None
+
+
+# /env and /beacon are plain Django views: each is one or two statements of
+# SQL, which DRF's per-request negotiation, parser, auth and throttle
+# machinery would outweigh. Bodies are validated by the pydantic schemas.
+
+@csrf_exempt
+@require_POST
+def env_view(request):
+    data, error = _parse_json_body(request)
+    if error is not None:
+        return error
+
+    try:
+        body = EnvBody.model_validate(data)
+    except ValidationError as e:
+        return _json_response(error_dict(e), status=400)
+    env_hash = body.env_hash
+
+    # Known snapshot: answer from an id-only lookup, without serializing
+    # the packages/env_vars JSON for an INSERT that would be a no-op
+    existing_id = (
+        EnvSnapshot.objects.filter(env_hash=env_hash, machine_arch=body.machine_arch)
+        .values_list("id", flat=True)
+        .first()
+    )
+    if existing_id is not None:
+        _mark_env_known(env_hash, existing_id)
+        return _json_response({"stored": False})
+
+    env_id, created = EnvSnapshot.objects.insert_if_absent(**body.model_dump())
+    _mark_env_known(env_hash, env_id)
+    if created:
+        # Link beacons that arrived before their snapshot
+        Beacon.objects.filter(env_hash=env_hash, env_snapshot__isnull=True).update(env_snapshot_id=env_id)
+    return _json_response({"stored": created})
+
+
+def _resolve_env_ids(env_hashes):
+    """env_hash -> EnvSnapshot id for every known hash, from the cache then one query for the rest"""
+    keys = {_env_cache_key(h): h for h in env_hashes}
+    env_ids = {keys[k]: env_id for k, env_id in cache.get_many(keys).items()}
+    missing = set(env_hashes) - env_ids.keys()
+    if missing:
+        found = dict(EnvSnapshot.objects.filter(env_hash__in=missing).values_list("env_hash", "id"))
+        cache.set_many({_env_cache_key(h): env_id for h, env_id in found.items()}, _ENV_CACHE_TTL)
+        env_ids.update(found)
+    return env_ids
+
+
+def _beacon_error_response(exc):
+    """
+    The /beacon reply for a failed post. A body that doesn't parse or fails
+    validation is the client's fault: a 400 and a one-line warning, as for
+    /env. Anything else is a 500 {"error": ...} with its traceback logged.
+    """
+    if not isinstance(exc, ValidationError):
+        log.exception("Error in beacon_view")
+        return _json_response({"error": str(exc)}, status=500)
+    if (response := _json_error_response(exc)) is not None:
+        return response
+    errors = error_dict(exc)
+    log.warning("Rejected beacon: %s", errors)
+    return _json_response({"error": str(errors)}, status=400)
+
+
+@csrf_exempt
+@require_POST
+def beacon_view(request):
+    # Parsed and validated straight from the body bytes in one pydantic-core call
+    if request.body.lstrip()[:1] == b"[":
+        return _store_beacons(request.body)
+    try:
+        fields = BeaconBody.model_validate_json(request.body).model_dump()
+        env_id = _cached_env_id(fields["env_hash"])
+        if env_id is not None:
+            beacon = Beacon.objects.create(**fields, env_snapshot_id=env_id)
+        else:
+            # Cache miss: the INSERT resolves the snapshot itself
+            beacon = Beacon.objects.create_linked(**fields)
+            if beacon.env_snapshot_id is not None: # type: ignore
+                _mark_env_known(beacon.env_hash, beacon.env_snapshot_id) # type: ignore
+
+        # Tell the agent whether we still need /env: 204 if so, 200 if not
+        need_env = beacon.env_snapshot_id is None # type: ignore
+        return HttpResponse(status=204 if need_env else 200)
+    except Exception as e:
+        return _beacon_error_response(e)
+
+
+def _store_beacons(raw):
+    """Store a batch of beacons; returns one {"need_env": bool} per beacon, in order"""
+    try:
+        beacons = [Beacon(**body.model_dump()) for body in BeaconBatch.validate_json(raw)]
+        env_ids = _resolve_env_ids({b.env_hash for b in beacons})
+        for beacon in beacons:
+            beacon.env_snapshot_id = env_ids.get(beacon.env_hash) # type: ignore
+        Beacon.objects.bulk_create(beacons, batch_size=_BEACON_BATCH_SIZE)
+        return _json_response([{"need_env": b.env_snapshot_id is None} for b in beacons]) # type: ignore
+    except Exception as e:
+        return _beacon_error_response(e)
+
+
+class _LazySuggestionService:
+    """Class attribute that swaps itself for the service on first access"""
+
+    def __get__(self, obj, owner):
+        svc = get_suggestion_service()
+        owner.suggestion_service = svc
+        return svc
 
-            # Tell the agent whether we still need /env
-            need_env = not EnvSnapshot.objects.filter(env_hash=beacon.env_hash).exists() # type: ignore
-            
-            # Return appropriate status code
-            if need_env:
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            else:
-                return Response(status=status.HTTP_200_OK)
-        except Exception as e:
-            print(f"Error in BeaconView: {e}")
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @method_decorator(csrf_exempt, name="dispatch")
 class SuggestView(APIView):
-    _suggestion_service = None  # Class-level singleton
-    
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # Use singleton service instance
-        if SuggestView._suggestion_service is None:
-            SuggestView._suggestion_service = ConfigSuggestionService()
-        self.suggestion_service = SuggestView._suggestion_service
-    
+    # Bound by wsgi.py/asgi.py at server start (runserver included);
+    # resolved on the first request elsewhere (tests, shell)
+    suggestion_service = _LazySuggestionService()
+
     def post(self, request):
         """Handle suggestion requests from the error agent client"""
         try:
@@ -57,145 +245,124 @@ class SuggestView(APIView):
             env_hash = request.data.get('env_hash')
             use_multiple_clusters = request.data.get('use_multiple_clusters', False)
             format_response = request.data.get('format_response', True)
+            text_only = request.data.get('text_only', False)
             
             if not error_sig:
                 return Response({"error": "error_sig required"}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Find configuration suggestions for this error
-            if use_multiple_clusters:
-                config_suggestion = self.suggestion_service.find_multiple_cluster_suggestions(
-                    error_sig=error_sig,
-                    error_trace=None  # Client only sends error_sig
-                )
-            else:
-                config_suggestion = self.suggestion_service.find_config_suggestion(
-                    error_sig=error_sig,
-                    error_trace=None  # Client only sends error_sig
-                )
-            
-            if not config_suggestion:
-                return Response({
-                    "match": False,
-                })
-            
-            # Ensure config_suggestion is a dictionary
-            if not isinstance(config_suggestion, dict):
-                print(f"Warning: config_suggestion is not a dict, it's {type(config_suggestion)}")
-                return Response({
-                    "match": False,
-                    "error": "Invalid suggestion format"
-                })
-            
-            # Format multiple suggestions for the client
-            suggestions = config_suggestion.get("suggestions", [])
-            if not isinstance(suggestions, list):
-                print(f"Warning: suggestions is not a list, it's {type(suggestions)}")
-                suggestions = []
-            
-            primary_suggestion = suggestions[0] if suggestions else None
-            
-            # Safe access to primary suggestion
-            recommendation_text = "No specific recommendation available"
-            if primary_suggestion and isinstance(primary_suggestion, dict):
-                recommendation_text = primary_suggestion.get("suggestion", "No specific recommendation available")
-            
-            suggestion_data = {
-                "match": True,
-                "confidence": config_suggestion.get("similarity", 0.0) if "similarity" in config_suggestion else 0.0,  # Handle both single and multiple cluster responses
-                "recommendation": recommendation_text,
-                "docs": f"Found {len(suggestions)} relevant configuration patterns",
-                "all_suggestions": [
-                    {
-                        "suggestion": suggestion.get("suggestion", ""),
-                        "config_key": suggestion.get("config_key", "unknown"),
-                        "config_value": suggestion.get("config_value", "unknown"),
-                        "confidence_percentage": suggestion.get("confidence_percentage", 0),
-                        "significance_score": suggestion.get("significance_score", 0.0)
-                    }
-                    for suggestion in suggestions
-                    if isinstance(suggestion, dict)  # Only process dictionary suggestions
-                ]
-            }
-            
-            # Add cluster info if available (for multiple cluster mode)
-            if "cluster_info" in config_suggestion:
-                cluster_info = config_suggestion["cluster_info"]
-                if isinstance(cluster_info, list):
-                    suggestion_data["cluster_info"] = cluster_info
-                    suggestion_data["clusters_analyzed"] = config_suggestion.get("clusters_analyzed", 1)
-            
-            if format_response: suggestion_data["formatted_text"] = self._build_formatted_text(suggestion_data)
-            return Response(suggestion_data)
+            # Answers only change when the cluster set does, so its
+            # fingerprint is part of the key and a re-analysis misses
+            svc = self.suggestion_service
+            key = _suggest_cache_key(error_sig, use_multiple_clusters, svc.clusters_version())
+            entry = cache.get(key)
+            if entry is None:
+                # A failed lookup (model missing, encode timeout) raises out
+                # of here to the 500 below and is never cached as a miss
+                suggestion_data = self._find_suggestions(svc, error_sig, use_multiple_clusters)
+                if suggestion_data.get("match"):
+                    # A pure function of the payload, so it is cached with it
+                    suggestion_data["formatted_text"] = self._build_formatted_text(suggestion_data)
+                entry = (_payload_digest(suggestion_data), suggestion_data)
+                if "error" not in suggestion_data:
+                    cache.set(key, entry, _SUGGEST_CACHE_TTL)
+            digest, suggestion_data = entry
+
+            # Agents re-polling an unchanged answer get a bodiless 304; the
+            # text-only, with- and without-formatted_text bodies are distinct
+            # representations
+            variant = "textonly" if text_only else "text" if format_response else "json"
+            etag = f'"{digest}-{variant}"'
+            if etag in parse_etags(request.headers.get("If-None-Match", "")):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+            if text_only and suggestion_data.get("match"):
+                # Clients that only print formatted_text skip the structured
+                # lists on the wire. They are still built, once per cache key:
+                # formatted_text is rendered from them, and the cached entry is
+                # shared with full-payload requests for the same signature.
+                return Response({k: suggestion_data[k] for k in _TEXT_ONLY_FIELDS}, headers={"ETag": etag})
+            if not format_response:
+                suggestion_data.pop("formatted_text", None)
+            return Response(suggestion_data, headers={"ETag": etag})
         except Exception as e:
-            print(f"Error in SuggestView: {e}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            log.exception("Error in SuggestView")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _find_suggestions(self, svc, error_sig, use_multiple_clusters):
+        """The /suggest payload for error_sig, without formatted_text"""
+        # Find configuration suggestions for this error
+        if use_multiple_clusters:
+            config_suggestion = svc.find_multiple_cluster_suggestions(
+                error_sig=error_sig,
+                error_trace=None  # Client only sends error_sig
+            )
+        else:
+            config_suggestion = svc.find_config_suggestion(
+                error_sig=error_sig,
+                error_trace=None  # Client only sends error_sig
+            )
+        
+        if not config_suggestion:
+            return {
+                "match": False,
+            }
+        
+        # Ensure config_suggestion is a dictionary
+        if not isinstance(config_suggestion, dict):
+            log.warning("config_suggestion is not a dict: %s", type(config_suggestion))
+            return {
+                "match": False,
+                "error": "Invalid suggestion format"
+            }
+        
+        # Format multiple suggestions for the client
+        suggestions = config_suggestion.get("suggestions", [])
+        if not isinstance(suggestions, list):
+            log.warning("suggestions is not a list: %s", type(suggestions))
+            suggestions = []
+        
+        recommendation_text = suggestions[0]["suggestion"] if suggestions else "No specific recommendation available"
+        
+        suggestion_data = {
+            "match": True,
+            "confidence": config_suggestion.get("similarity", 0.0),  # Multi-cluster responses carry none
+            "recommendation": recommendation_text,
+            "docs_count": len(suggestions),
+            # The service builds every suggestion with all of _SUG_FIELDS
+            "all_suggestions": [dict(zip(_SUG_FIELDS, _get_sug_fields(s))) for s in suggestions]
+        }
+        
+        # Add cluster info if available (for multiple cluster mode)
+        if "cluster_info" in config_suggestion:
+            cluster_info = config_suggestion["cluster_info"]
+            if isinstance(cluster_info, list):
+                suggestion_data["cluster_info"] = cluster_info
+                suggestion_data["clusters_analyzed"] = config_suggestion.get("clusters_analyzed", 1)
+        return suggestion_data
+
     def _build_formatted_text(self, h: dict) -> str:
         """Turn the JSON payload into a CLI‑friendly multiline string."""
-        bar = "─" * 72
-        lines = [f"\n{bar}"]
-        
-        # Safe confidence calculation
         confidence = h.get('confidence', 0.0)
         if confidence is None:
             confidence = 0.0
-        lines.append(f"[INFO] corp-error-agent:  {int(confidence*100)}% match")
-        
-        if docs := h.get("docs"):
-            lines.append(f"[INFO] {docs}")
-        lines.append(bar)
+        lines = [f"\n{_BAR}", f"[INFO] corp-error-agent:  {int(confidence*100)}% match"]
+        if (docs_count := h.get("docs_count")) is not None:
+            lines.append(f"[INFO] Found {docs_count} relevant configuration patterns")
+        lines.append(_BAR)
 
         # Multi‑cluster summary
         if cinfo := h.get("cluster_info"):
-            count = h.get("clusters_analyzed", len(cinfo))
-            lines.append(f"[CLUSTERS] Analyzed {count} cluster(s):")
-            for idx, c in enumerate(cinfo, 1):
-                # Safe similarity calculation
-                similarity = c.get("similarity", 0.0)
-                if similarity is None:
-                    similarity = 0.0
-                sim = int(similarity * 100)
-                
-                cnt = c.get("error_count", "?")
-                fs = c.get("first_seen", "unknown")
-                ls = c.get("last_seen", "unknown")
-                sig = c.get("error_signature", "").strip()
-                
-                # Format dates if they're datetime objects
-                if hasattr(fs, 'strftime'):
-                    fs = fs.strftime('%Y-%m-%d %H:%M')
-                if hasattr(ls, 'strftime'):
-                    ls = ls.strftime('%Y-%m-%d %H:%M')
-                
-                lines.append(
-                    f"  [{idx}] {sim}% similar · {cnt} errors ·"
-                    f" {fs} → {ls}\n"
-                    f"       signature: {sig}"
-                )
-            lines.append(bar)
+            lines.append(f"[CLUSTERS] Analyzed {h.get('clusters_analyzed', len(cinfo))} cluster(s):")
+            lines.extend(_format_cluster(idx, c) for idx, c in enumerate(cinfo, 1))
+            lines.append(_BAR)
 
         # All suggestions
         if sugs := h.get("all_suggestions", []):
             lines.append(f"[SUGGESTIONS] Configuration suggestions ({len(sugs)}):")
-            for i, sug in enumerate(sugs, 1):
-                # Safe dictionary access with defaults
-                txt = sug.get("suggestion", "").strip()
-                key = sug.get("config_key", "unknown")
-                val = sug.get("config_value", "unknown")
-                pct = sug.get("confidence_percentage", 0)
-                score = sug.get("significance_score", 0.0)
-                
-                lines.append(
-                    f"{i:2}. {txt}\n"
-                    f"       -> {key} = {val}  "
-                    f"(conf: {pct}%, score: {score:.2f})"
-                )
+            lines.extend(_format_suggestion(i, sug) for i, sug in enumerate(sugs, 1))
         else:
             # fallback single recommendation
-            recommendation = h.get('recommendation', '').strip()
-            lines.append(f"[SUGGESTION] {recommendation}")
+            lines.append(f"[SUGGESTION] {h.get('recommendation', '').strip()}")
 
-        lines.append(bar)
-        return "\n".join(lines)
\ No newline at end of file
+        lines.append(_BAR)
+        return "\n".join(lines)
@@ -3,6 +3,10 @@
 Simple test script to verify package parsing functionality
 """
 
+# Version operators in the order they are tried: the first one present in a
+# spec splits it, wherever it occurs ("a>1,==2" splits on "==")
+_PKG_SPEC_OPS = ('==', '>=', '<=', '>', '<')
+
 def parse_packages(packages):
     """
     Parse packages from either dict or list format
@@ -19,37 +23,15 @@ def parse_packages(packages):
         # Parse list format like ["build==1.2.2.post1", "certifi==2025.6.15", ...]
         parsed_packages = {}
         for pkg_spec in packages:
-            if isinstance(pkg_spec, str) and '==' in pkg_spec:
-                # Handle "package==version" format
-                parts = pkg_spec.split('==', 1)
-                if len(parts) == 2:
-                    pkg_name, pkg_version = parts
-                    parsed_packages[pkg_name] = pkg_version
-            elif isinstance(pkg_spec, str) and '>=' in pkg_spec:
-                # Handle "package>=version" format
-                parts = pkg_spec.split('>=', 1)
-                if len(parts) == 2:
-                    pkg_name, pkg_version = parts
-                    parsed_packages[pkg_name] = f">={pkg_version}"
-            elif isinstance(pkg_spec, str) and '<=' in pkg_spec:
-                # Handle "package<=version" format
-                parts = pkg_spec.split('<=', 1)
-                if len(parts) == 2:
-                    pkg_name, pkg_version = parts
-                    parsed_packages[pkg_name] = f"<={pkg_version}"
-            elif isinstance(pkg_spec, str) and '>' in pkg_spec:
-                # Handle "package>version" format
-                parts = pkg_spec.split('>', 1)
-                if len(parts) == 2:
-                    pkg_name, pkg_version = parts
-                    parsed_packages[pkg_name] = f">{pkg_version}"
-            elif isinstance(pkg_spec, str) and '<' in pkg_spec:
-                # Handle "package<version" format
-                parts = pkg_spec.split('<', 1)
-                if len(parts) == 2:
-                    pkg_name, pkg_version = parts
-                    parsed_packages[pkg_name] = f"<{pkg_version}"
-            elif isinstance(pkg_spec, str):
+            if not isinstance(pkg_spec, str):
+                continue
+            # Pinned "name==version" is the common case: one partition and done
+            for op in _PKG_SPEC_OPS:
+                pkg_name, sep, pkg_version = pkg_spec.partition(op)
+                if sep:
+                    parsed_packages[pkg_name] = pkg_version if op == '==' else f"{op}{pkg_version}"
+                    break
+            else:
                 # Just package name without version
                 parsed_packages[pkg_spec] = "unknown"
         